@@ -0,0 +1,584 @@
+"""Benchmarks de StreamFlix contra una biblioteca sintética.
+
+Uso:
+    python benchmark.py                       # Todos los benchmarks, JSON por stdout
+    python benchmark.py --output bench.json   # Guardar resultados en un archivo
+    python benchmark.py --only scan,stream    # Solo algunos benchmarks
+
+Todo se ejecuta en local (127.0.0.1), sin red. Los resultados se emiten en
+JSON para poder comparar distintas versiones.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+import statistics
+import urllib.request
+from datetime import datetime
+
+
+def percentiles(samples):
+    """Resumen de latencias en milisegundos"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+
+def write_small_video(path, seed, frames=48, size=(320, 180)):
+    """Genera un video corto y único con OpenCV o ffmpeg; si no hay ninguno, bytes de relleno"""
+    try:
+        import cv2
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 24, size)
+        for i in range(frames):
+            frame = np.full((size[1], size[0], 3), (i * 5) % 255, dtype=np.uint8)
+            frame[:size[1] // 3] = rng.integers(0, 255, (size[1] // 3, size[0], 3), dtype=np.uint8)
+            cv2.putText(frame, f'{seed}:{i}', (20, size[1] // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+            writer.write(frame)
+        writer.release()
+        if os.path.getsize(path) > 0:
+            return 'opencv'
+    except Exception:
+        pass
+
+    if shutil.which('ffmpeg'):
+        result = subprocess.run(
+            ['ffmpeg', '-y', '-f', 'lavfi', '-i', f'testsrc=size={size[0]}x{size[1]}:rate=24',
+             '-frames:v', str(frames), '-vf', f'hue=h={seed * 37 % 360}', '-pix_fmt', 'yuv420p', path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if result.returncode == 0:
+            return 'ffmpeg'
+
+    with open(path, 'wb') as f:
+        f.write(os.urandom(256 * 1024))
+    return 'random'
+
+
+def write_long_gop_video(path, seconds=60, size=(1280, 720), key_interval=250):
+    """Video 720p con GOP largo (keyint 250, el de x264) generado con ffmpeg
+
+    OpenCV fija su propio GOP corto al escribir, así que sin ffmpeg devuelve False.
+    """
+    if not shutil.which('ffmpeg'):
+        return False
+    result = subprocess.run(
+        ['ffmpeg', '-y', '-f', 'lavfi', '-i', f'testsrc2=size={size[0]}x{size[1]}:rate=24',
+         '-t', str(seconds), '-c:v', 'mpeg4', '-q:v', '5', '-g', str(key_interval),
+         '-pix_fmt', 'yuv420p', path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return result.returncode == 0
+
+
+def make_library(base_folder, titles, sparse_files, sparse_size):
+    """Crea la biblioteca sintética: videos pequeños y archivos dispersos grandes"""
+    movies = os.path.join(base_folder, 'Movies')
+    os.makedirs(movies, exist_ok=True)
+
+    generators = set()
+    for i in range(titles):
+        generators.add(write_small_video(os.path.join(movies, f'bench_title_{i:04d}.mp4'), i))
+
+    # Archivos dispersos: ocupan tamaño lógico sin escribir los datos (salvo una
+    # cabecera distinta en cada uno, para que no se dedupliquen entre sí)
+    for i in range(sparse_files):
+        with open(os.path.join(movies, f'bench_sparse_{i:02d}.mp4'), 'wb') as f:
+            f.write(os.urandom(65536))
+            f.truncate(sparse_size)
+
+    # Copia idéntica de un título en otra carpeta: el escaneo debe fusionarla
+    if titles:
+        os.makedirs(os.path.join(movies, 'copies'), exist_ok=True)
+        shutil.copyfile(os.path.join(movies, 'bench_title_0000.mp4'),
+                        os.path.join(movies, 'copies', 'bench_title_0000.mp4'))
+
+    return sorted(generators)
+
+
+def start_server(app):
+    """Arranca la app Flask en un puerto libre de 127.0.0.1"""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def fetch(url, headers=None, limit=None, expect=None):
+    """GET que devuelve (bytes leídos, segundos hasta el primer byte, segundos totales)
+
+    Con `expect`, un código de estado distinto lanza ValueError.
+    """
+    started = time.perf_counter()
+    req = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(req, timeout=60) as response:
+        if expect is not None and response.status != expect:
+            raise ValueError(f'estado {response.status} (se esperaba {expect})')
+        first = response.read(1)
+        ttfb = time.perf_counter() - started
+        total = len(first)
+        while first:
+            if limit is not None and total >= limit:
+                break
+            data = response.read(65536)
+            if not data:
+                break
+            total += len(data)
+    return total, ttfb, time.perf_counter() - started
+
+
+def bench_scan(ctx):
+    netflix = ctx['netflix']
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        netflix.scan_content()
+    warm = time.perf_counter() - started
+
+    # La copia de make_library tiene que aparecer como duplicado, no como título
+    movies = netflix.catalog.movies
+    duplicates = sum(len(movie.duplicates or ()) for movie in movies)
+    if ctx['args'].titles and duplicates != 1:
+        return {'error': f'copia duplicada no fusionada ({duplicates} duplicados)'}
+    return {
+        'cold_seconds': round(ctx['cold_scan'], 4),
+        'warm_seconds': round(warm, 4),
+        'titles': len(movies),
+        'duplicates': duplicates
+    }
+
+
+def bench_api_content(ctx):
+    samples = []
+    for _ in range(ctx['args'].requests):
+        _, _, elapsed = fetch(ctx['url'] + '/api/content')
+        samples.append(elapsed)
+    return percentiles(samples)
+
+
+def bench_index(ctx):
+    """Latencia de la página principal y bytes de una carga en frío con gzip"""
+    samples = []
+    for _ in range(ctx['args'].requests):
+        _, _, elapsed = fetch(ctx['url'] + '/', headers={'Accept-Encoding': 'gzip'})
+        samples.append(elapsed)
+
+    # Bytes transferidos: página + recursos enlazados, comprimidos
+    cold_bytes = 0
+    req = urllib.request.Request(ctx['url'] + '/', headers={'Accept-Encoding': 'gzip'})
+    with urllib.request.urlopen(req, timeout=60) as response:
+        body = response.read()
+        cold_bytes += len(body)
+    page = ctx['netflix'].index_page.body.decode('utf-8')
+    for path in re.findall(r'(?:href|src)="(/assets/[^"]+)"', page):
+        req = urllib.request.Request(ctx['url'] + path, headers={'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(req, timeout=60) as response:
+            cold_bytes += len(response.read())
+
+    result = percentiles(samples)
+    result['cold_load_bytes_gzip'] = cold_bytes
+    return result
+
+
+def bench_thumbnails(ctx):
+    """Miniaturas por segundo (selección de frame puntuada + escritura del JPEG)"""
+    netflix = ctx['netflix']
+    titles = [m for m in netflix.content_db['movies'] if m.file.startswith('bench_title_')]
+    if not titles or 'random' in ctx['generators']:
+        return {'skipped': 'sin videos decodificables'}
+
+    output = tempfile.mkdtemp(prefix='streamflix-thumbs-')
+    samples = []
+    try:
+        started = time.perf_counter()
+        for movie in titles:
+            title_started = time.perf_counter()
+            netflix.generate_thumbnail(movie.path, os.path.join(output, f"{movie.id}.jpg"))
+            samples.append(time.perf_counter() - title_started)
+        wall = time.perf_counter() - started
+    finally:
+        # Las variantes WebP/AVIF se escriben en segundo plano: esperar a que
+        # terminen antes de borrar la carpeta y de pasar al siguiente benchmark
+        drain_started = time.perf_counter()
+        netflix.thumbnail_executor.submit(lambda: None).result()
+        variants_drain = time.perf_counter() - drain_started
+        shutil.rmtree(output, ignore_errors=True)
+
+    # Coste aislado de la pasada de puntuación sobre los candidatos reducidos
+    import numpy as np
+    from nfx import THUMBNAIL_CANDIDATES, SCORE_SIZE, score_frames
+
+    frames = np.random.default_rng(0).integers(
+        0, 255, (len(THUMBNAIL_CANDIDATES), SCORE_SIZE[1], SCORE_SIZE[0]), dtype=np.uint8)
+    rounds = 200
+    score_started = time.perf_counter()
+    for _ in range(rounds):
+        score_frames(frames)
+    score_ms = (time.perf_counter() - score_started) / rounds * 1000
+
+    # Los clips sintéticos de 48 frames no miden el coste de los seeks: cada
+    # candidato decodifica desde el keyframe anterior, hasta un GOP entero
+    long_gop = {'skipped': 'ffmpeg no disponible'}
+    long_path = os.path.join(ctx['base_folder'], 'long_gop.mp4')
+    if write_long_gop_video(long_path):
+        picks = []
+        for _ in range(3):
+            pick_started = time.perf_counter()
+            netflix.pick_thumbnail_frame(long_path)
+            picks.append(time.perf_counter() - pick_started)
+        long_gop = percentiles(picks)
+        os.remove(long_path)
+
+    result = percentiles(samples)
+    result.update({
+        'thumbnails_per_second': round(len(samples) / wall, 2),
+        'variants_drain_s': round(variants_drain, 3),
+        'score_pass_ms': round(score_ms, 3),
+        'long_gop_720p': long_gop
+    })
+    return result
+
+
+def bench_stream(ctx):
+    """Throughput de /stream con varios clientes pidiendo rangos aleatorios"""
+    args = ctx['args']
+    sparse = [m for m in ctx['netflix'].content_db['movies'] if m.file.startswith('bench_sparse_')]
+    if not sparse:
+        return {'skipped': 'sin archivos dispersos'}
+
+    window = 1048576
+    samples = []
+    totals = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        for _ in range(args.requests):
+            movie = rng.choice(sparse)
+            start = rng.randrange(0, args.sparse_size - window)
+            # Una respuesta cortada no cuenta como throughput: es un fallo
+            try:
+                size, _, elapsed = fetch(
+                    ctx['url'] + f"/stream/{movie.id}",
+                    headers={'Range': f'bytes={start}-{start + window - 1}'},
+                    expect=206
+                )
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            with lock:
+                if size != window:
+                    errors.append(f'{size} bytes de {window}')
+                samples.append(elapsed)
+                totals.append(size)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    if errors:
+        return {'error': f'{len(errors)} de {args.clients * args.requests} rangos incompletos',
+                'examples': errors[:3]}
+    result = percentiles(samples)
+    result.update({
+        'clients': args.clients,
+        'bytes': sum(totals),
+        'wall_seconds': round(wall, 4),
+        'throughput_mb_s': round(sum(totals) / wall / 1048576, 2)
+    })
+    return result
+
+
+def bench_metrics(ctx):
+    """Latencia de /metrics; antes comprueba un histograma con buckets finitos y +Inf"""
+    from nfx import Metrics
+
+    metrics = Metrics()
+    metrics.describe('check_seconds', 'histogram', 'Comprobación', Metrics.BUCKETS['seconds'])
+    metrics.describe('check_total', 'counter', 'Comprobación')
+    metrics.observe('check_seconds', 0.001, route='stream')
+    metrics.observe('check_seconds', 3600, route='stream')
+    metrics.inc('check_total', route='stream')
+    try:
+        text = metrics.render()
+    except Exception as e:
+        return {'error': f'render con bucket +Inf: {e!r}'}
+    if 'check_seconds_bucket{route="stream",le="+Inf"} 2' not in text:
+        return {'error': 'bucket +Inf acumulado incorrecto'}
+
+    samples = []
+    for _ in range(ctx['args'].requests):
+        _, _, elapsed = fetch(ctx['url'] + '/metrics')
+        samples.append(elapsed)
+    return percentiles(samples)
+
+
+def bench_compat(ctx):
+    """Tiempo hasta el primer byte de /compat desde el inicio y tras un salto (?t=)"""
+    if not shutil.which('ffmpeg'):
+        return {'skipped': 'ffmpeg no disponible'}
+    titles = [m for m in ctx['netflix'].content_db['movies'] if m.file.startswith('bench_title_')]
+    if not titles or 'random' in ctx['generators']:
+        return {'skipped': 'sin videos decodificables'}
+
+    start, seek = [], []
+    for movie in titles[:max(1, min(len(titles), ctx['args'].requests // 10))]:
+        _, ttfb, _ = fetch(ctx['url'] + f"/stream/{movie.id}/compat", limit=65536)
+        start.append(ttfb)
+        # Mitad de los 2s de video sintético
+        _, ttfb, _ = fetch(ctx['url'] + f"/stream/{movie.id}/compat?t=1", limit=65536)
+        seek.append(ttfb)
+    return {'start': percentiles(start), 'seek': percentiles(seek)}
+
+
+# Arranque en frío de un servidor headless hasta servir la primera petición
+STARTUP_SCRIPT = '''
+import sys, time, json
+started = time.perf_counter()
+import nfx
+imported = time.perf_counter()
+heavy = sorted(m for m in ('cv2', 'PIL', 'numpy', 'flask', 'flask_cors') if m in sys.modules)
+netflix = nfx.StreamFlix(base_folder=sys.argv[1], headless=True)
+constructed = time.perf_counter()
+client = netflix.app.test_client()
+client.get('/api/content')
+served = time.perf_counter()
+netflix.scan_ready.wait()
+scanned = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'heavy_modules_on_import': heavy,
+    'construct': constructed - imported,
+    'first_request': served - started,
+    'scan_done': scanned - started
+}))
+'''
+
+
+def bench_startup(ctx):
+    """Tiempo de import de nfx y de arranque headless (procesos nuevos, en frío)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(5):
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT, ctx['base_folder']],
+            cwd=here, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1:]}
+        # El escaneo imprime por stdout: el JSON es la última línea
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    summary = {'heavy_modules_on_import': runs[0]['heavy_modules_on_import']}
+    for key in ('import', 'construct', 'first_request', 'scan_done'):
+        summary[key + '_ms'] = percentiles([run[key] for run in runs])['p50_ms']
+    return summary
+
+
+# Catálogo sintético de N títulos en un proceso nuevo: memoria residente de
+# los registros más el JSON precalculado de /api/content
+MEMORY_SCRIPT = '''
+import sys, json, random, resource
+import nfx
+
+layout, count = sys.argv[1], int(sys.argv[2])
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+rng = random.Random(0)
+baseline = rss()
+movies = []
+for i in range(count):
+    minutes = rng.randint(80, 150)
+    fields = dict(
+        id=f'{rng.getrandbits(64):016x}',
+        title=f'Title {i:06d}',
+        file=f'Collection {i % 500}/title_{i:06d}.mp4',
+        root='/media/' + 'Movies',
+        volume='Mov' + 'ies',
+        duration=f'{minutes // 60}h {minutes % 60}min',
+        year=rng.randint(2018, 2024)
+    )
+    if layout == 'slots':
+        movies.append(nfx.Movie(genre=nfx.GENRES[i % len(nfx.GENRES)], added=rng.uniform(1.5e9, 1.7e9), **fields))
+    else:
+        # Formato anterior: un dict por título con ruta y miniatura guardadas
+        fields['path'] = fields['root'] + '/' + fields['file']
+        fields['thumbnail'] = f"/thumbnail/{fields['id']}.jpg"
+        fields['rating'] = round(rng.uniform(7.0, 9.5), 1)
+        fields['match'] = rng.randint(85, 99)
+        movies.append(fields)
+
+if layout == 'slots':
+    catalog = nfx.Catalog(1, movies)
+    body = len(catalog.asset.body)
+else:
+    categories = {'trending': movies[:5], 'new_releases': movies[:3]}
+    content = {'version': 1, 'movies': movies, 'series': [], 'continue_watching': [], 'sprites': {},
+               'categories': {name: categories.get(name, []) for name in nfx.CATALOG_CATEGORIES}}
+    asset = nfx.StaticAsset('content.json', json.dumps(content, sort_keys=True, separators=(',', ':')),
+                            'application/json', fast=True)
+    body = len(asset.body)
+
+print(json.dumps({
+    'resident_mb': round((rss() - baseline) / 1024 ** 2, 1),
+    'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    'json_mb': round(body / 1024 ** 2, 1)
+}))
+'''
+
+
+def bench_memory(ctx):
+    """Memoria del catálogo con un dict por título frente a registros compactos"""
+    if not os.path.exists('/proc/self/statm'):
+        return {'skipped': 'requiere /proc (Linux)'}
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for count in ctx['args'].memory_titles:
+        row = {}
+        for layout in ('dict', 'slots'):
+            result = subprocess.run(
+                [sys.executable, '-c', MEMORY_SCRIPT, layout, str(count)],
+                cwd=here, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                return {'error': result.stderr.strip().splitlines()[-1:]}
+            row[layout] = json.loads(result.stdout.strip().splitlines()[-1])
+        results[str(count)] = row
+    return results
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'scan': bench_scan,
+    'index': bench_index,
+    'api_content': bench_api_content,
+    'thumbnails': bench_thumbnails,
+    'stream': bench_stream,
+    'compat': bench_compat,
+    'metrics': bench_metrics,
+    'memory': bench_memory
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks de StreamFlix')
+    parser.add_argument('--titles', type=int, default=20, help='Videos pequeños generados')
+    parser.add_argument('--sparse-files', type=int, default=2, help='Archivos dispersos para rangos')
+    parser.add_argument('--sparse-size', type=int, default=4 * 1024 ** 3, help='Tamaño de cada archivo disperso')
+    parser.add_argument('--clients', type=int, default=8, help='Clientes concurrentes en /stream')
+    parser.add_argument('--requests', type=int, default=50, help='Peticiones por cliente/benchmark')
+    parser.add_argument('--memory-titles', type=lambda value: [int(n) for n in value.split(',')],
+                        default=[10000, 100000], help='Tamaños de catálogo para el benchmark de memoria')
+    parser.add_argument('--only', default='', help='Lista de benchmarks separados por comas')
+    parser.add_argument('--output', help='Archivo JSON de salida (por defecto stdout)')
+    parser.add_argument('--keep', action='store_true', help='No borrar la biblioteca sintética')
+    args = parser.parse_args()
+
+    selected = [name for name in args.only.split(',') if name] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            parser.error(f'benchmark desconocido: {name}')
+
+    base_folder = tempfile.mkdtemp(prefix='streamflix-bench-')
+    try:
+        generators = make_library(base_folder, args.titles, args.sparse_files, args.sparse_size)
+
+        from nfx import StreamFlix
+
+        # El escaneo imprime por stdout; se desvía para no mezclarlo con el JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            started = time.perf_counter()
+            netflix = StreamFlix(base_folder=base_folder)
+            cold_scan = time.perf_counter() - started
+
+        server, url = start_server(netflix.app)
+        ctx = {
+            'args': args,
+            'netflix': netflix,
+            'url': url,
+            'base_folder': base_folder,
+            'cold_scan': cold_scan,
+            'generators': generators
+        }
+
+        results = {}
+        try:
+            for name in selected:
+                results[name] = BENCHMARKS[name](ctx)
+        finally:
+            server.shutdown()
+            # La popularidad se guarda en la biblioteca sintética: antes de borrarla
+            netflix.popularity.save()
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'video_generator': generators,
+                'params': vars(args)
+            },
+            'results': results
+        }
+    finally:
+        if args.keep:
+            print(f'Biblioteca sintética en {base_folder}', file=sys.stderr)
+        else:
+            shutil.rmtree(base_folder, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,879 +1,2896 @@
 import os
+import re
 import json
-import mimetypes
 import socket
-from pathlib import Path
-from flask import Flask, render_template_string, send_file, jsonify, request, Response
-from flask_cors import CORS
-import cv2
-from PIL import Image
 import io
 import hashlib
+import gzip
 import subprocess
-import random
-from datetime import datetime
 import threading
 import time
+import select
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import itertools
+import contextlib
+import collections
+import heapq
 
-class StreamFlix:
-    def __init__(self):
-        self.app = Flask(__name__)
-        CORS(self.app)
-        
-        # Configuración
-        self.host = self.get_local_ip()
-        self.port = 8888
-        
-        # Carpetas de contenido
-        self.movies_folder = os.path.join(os.path.expanduser("~"), "StreamFlix", "Movies")
-        self.series_folder = os.path.join(os.path.expanduser("~"), "StreamFlix", "Series")
-        self.thumbnails_folder = os.path.join(os.path.expanduser("~"), "StreamFlix", ".thumbnails")
-        
-        # Crear carpetas
-        for folder in [self.movies_folder, self.series_folder, self.thumbnails_folder]:
-            os.makedirs(folder, exist_ok=True)
-        
-        # Base de datos de contenido
-        self.content_db = {
-            'movies': [],
-            'series': [],
-            'continue_watching': [],
-            'categories': {
-                'trending': [],
-                'new_releases': [],
-                'action': [],
-                'comedy': [],
-                'drama': [],
-                'scifi': [],
-                'horror': []
-            }
-        }
-        
-        # Escanear contenido
-        self.scan_content()
-        
-        # Configurar rutas
-        self.setup_routes()
+
+# Flask y OpenCV se importan bajo demanda: importar nfx no carga nada pesado
+cv2 = None
+
+
+def load_cv2():
+    """Importa OpenCV la primera vez que hace falta (miniaturas y duraciones)"""
+    global cv2
+    if cv2 is None:
+        import cv2 as module
+        cv2 = module
+    return cv2
+
+
+# Formatos de miniatura, del más compacto al más compatible
+IMAGE_FORMATS = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpg': 'image/jpeg'
+}
+
+# None = aún no se ha probado si se puede codificar AVIF
+avif_supported = None
+
+
+def encode_image(image, fmt, quality=None):
+    """Codifica un frame BGR en jpg/webp/avif; None si el formato no está disponible"""
+    global avif_supported
+    cv2 = load_cv2()
     
-    def get_local_ip(self):
+    if fmt == 'avif':
+        if avif_supported is False:
+            return None
+        data = None
+        flag = getattr(cv2, 'IMWRITE_AVIF_QUALITY', None)
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except:
-            return "127.0.0.1"
+            ok, encoded = cv2.imencode('.avif', image, [flag, quality or 50] if flag is not None else [])
+            if ok:
+                data = encoded.tobytes()
+        except cv2.error:
+            pass
+        if data is None:
+            # OpenCV sin libavif: probar con Pillow (si está instalado con AVIF)
+            try:
+                from PIL import Image
+                buffer = io.BytesIO()
+                Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(buffer, 'AVIF', quality=quality or 50)
+                data = buffer.getvalue()
+            except Exception:
+                pass
+        avif_supported = data is not None
+        return data
     
-    def generate_thumbnail(self, video_path, output_path):
-        """Genera miniatura del video"""
+    if fmt == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality or 75]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality or 95]
+    ok, encoded = cv2.imencode('.' + fmt, image, params)
+    return encoded.tobytes() if ok else None
+
+
+# Posiciones candidatas para la miniatura (fracción de la duración)
+THUMBNAIL_CANDIDATES = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7)
+# Tamaño reducido al que se puntúan los candidatos
+SCORE_SIZE = (160, 90)
+
+
+def score_frames(gray):
+    """Puntúa frames en escala de grises (array k x alto x ancho) de una sola pasada
+
+    Premia la exposición media, el contraste (desviación típica) y la nitidez
+    (varianza del laplaciano); los frames casi negros o quemados puntúan 0.
+    """
+    import numpy as np
+    
+    gray = gray.astype(np.float32)
+    brightness = gray.mean(axis=(1, 2))
+    contrast = gray.std(axis=(1, 2))
+    laplacian = (4 * gray[:, 1:-1, 1:-1] - gray[:, :-2, 1:-1] - gray[:, 2:, 1:-1]
+                 - gray[:, 1:-1, :-2] - gray[:, 1:-1, 2:])
+    sharpness = laplacian.var(axis=(1, 2))
+    
+    exposure = np.clip(1 - np.abs(brightness - 118) / 118, 0, 1)
+    score = exposure * (np.minimum(contrast / 64, 1) + np.log1p(sharpness) / 10)
+    return np.where((brightness < 16) | (brightness > 240), 0, score)
+
+
+class TokenBucket:
+    """Cubeta de tokens (bytes/s) que admite saldo negativo"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Descuenta `amount` tokens y devuelve los segundos hasta saldar la deuda"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class StreamThrottle:
+    """Limitador de una conexión: reparte cada bloque entre todas sus cubetas"""
+
+    def __init__(self, buckets, min_sleep):
+        self.buckets = buckets
+        self.min_sleep = min_sleep
+
+    def consume(self, amount, cancelled=None):
+        # La deuda se acumula en las cubetas y solo se duerme cuando supera
+        # min_sleep, así no hay un sleep por cada bloque leído
+        wait = 0.0
+        for bucket in self.buckets:
+            wait = max(wait, bucket.reserve(amount))
+        if wait >= self.min_sleep:
+            # Esperar en el evento de cancelación para despertar al momento
+            if cancelled is not None:
+                cancelled.wait(wait)
+            else:
+                time.sleep(wait)
+
+
+class BandwidthShaper:
+    """Límites de ancho de banda por conexión, por IP, globales y por prioridad"""
+
+    # Fracción del límite global que puede usar cada clase de prioridad
+    PRIORITY_SHARES = {
+        'tv': 1.0,         # Reproducción en TVs
+        'browser': 0.6,    # Reproducción en navegadores
+        'prefetch': 0.3    # Precargas
+    }
+    # Fracción del límite global reservada a las TVs: el resto de clases
+    # comparten una cubeta común que nunca pasa de (1 - TV_RESERVE)
+    TV_RESERVE = 0.25
+
+    def __init__(self, global_rate=None, client_rate=None, connection_rate=None, min_sleep=0.05):
+        self.global_rate = global_rate
+        self.client_rate = client_rate
+        self.connection_rate = connection_rate
+        self.min_sleep = min_sleep
+
+        self.global_bucket = TokenBucket(global_rate) if global_rate else None
+        self.class_buckets = {}
+        self.shared_bucket = None
+        if global_rate:
+            for priority, share in self.PRIORITY_SHARES.items():
+                self.class_buckets[priority] = TokenBucket(global_rate * share)
+            self.shared_bucket = TokenBucket(global_rate * (1 - self.TV_RESERVE))
+
+        self.client_buckets = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.global_rate or self.client_rate or self.connection_rate)
+
+    def get_client_bucket(self, client_ip):
+        with self.lock:
+            bucket = self.client_buckets.get(client_ip)
+            if bucket is None:
+                # Olvidar clientes inactivos desde hace más de 5 minutos
+                now = time.monotonic()
+                for ip, old in list(self.client_buckets.items()):
+                    if now - old.stamp > 300:
+                        del self.client_buckets[ip]
+                bucket = TokenBucket(self.client_rate)
+                self.client_buckets[client_ip] = bucket
+            return bucket
+
+    def open(self, client_ip, priority='browser'):
+        """Devuelve el limitador de una nueva conexión, o None si no hay límites"""
+        if not self.enabled:
+            return None
+
+        buckets = []
+        if self.connection_rate:
+            buckets.append(TokenBucket(self.connection_rate))
+        if self.client_rate:
+            buckets.append(self.get_client_bucket(client_ip))
+        if self.global_bucket:
+            buckets.append(self.global_bucket)
+            if priority not in self.class_buckets:
+                priority = 'browser'
+            buckets.append(self.class_buckets[priority])
+            if priority != 'tv':
+                buckets.append(self.shared_bucket)
+
+        return StreamThrottle(buckets, self.min_sleep)
+
+
+class ActiveStream:
+    """Stream en curso: se puede cancelar y sabe si el cliente sigue conectado"""
+
+    # Cada cuánto se comprueba el socket (segundos)
+    LIVENESS_INTERVAL = 0.5
+
+    def __init__(self, client, video_id, route, sock=None, session=None, bounded=False):
+        self.client = client
+        self.video_id = video_id
+        self.route = route
+        self.sock = sock
+        self.session = session      # Reproductor que lo pidió (token de /api/play)
+        self.bounded = bounded      # Rango con final explícito: otro lector lo necesita entero
+        self.process = None
+        self.cancelled = threading.Event()
+        self.started = time.time()
+        self.checked = time.monotonic()
+
+    def attach(self, process):
+        """Asocia el proceso ffmpeg para matarlo al cancelar"""
+        self.process = process
+        if self.cancelled.is_set():
+            self.kill()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.kill()
+
+    def kill(self):
+        process = self.process
+        if process is not None and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def client_connected(self):
+        """Mira sin bloquear si el cliente cerró el socket (lectura de 0 bytes)"""
+        if self.sock is None:
+            return True
         try:
-            cap = cv2.VideoCapture(video_path)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            # Capturar frame al 10% del video
-            frame_pos = int(total_frames * 0.1)
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
-            
-            ret, frame = cap.read()
-            if ret:
-                # Redimensionar a 16:9
-                height = 200
-                width = int(height * 16 / 9)
-                frame = cv2.resize(frame, (width, height))
-                
-                # Guardar
-                cv2.imwrite(output_path, frame)
-            
-            cap.release()
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                return self.sock.recv(1, socket.MSG_PEEK) != b''
             return True
-        except:
+        except (OSError, ValueError):
             return False
-    
-    def get_video_duration(self, video_path):
-        """Obtiene duración del video"""
+
+    def alive(self):
+        if self.cancelled.is_set():
+            return False
+        now = time.monotonic()
+        if now - self.checked >= self.LIVENESS_INTERVAL:
+            self.checked = now
+            if not self.client_connected():
+                self.cancelled.set()
+                return False
+        return True
+
+
+class StreamRegistry:
+    """Streams activos por cliente; un seek del mismo reproductor sustituye a su stream abierto"""
+
+    def __init__(self):
+        self.streams = set()
+        self.lock = threading.Lock()
+
+    def open(self, client, video_id, route, sock=None, session=None, bounded=False):
+        stream = ActiveStream(client, video_id, route, sock, session, bounded)
+        with self.lock:
+            # Solo es un seek si viene de la misma sesión de reproductor: una IP puede
+            # ser varias pestañas o equipos, y un navegador solapa rangos a propósito.
+            # Los rangos acotados nunca se cortan; el resto lo limpia la vigilancia del socket
+            superseded = [] if session is None else [
+                s for s in self.streams
+                if (s.session, s.video_id, s.route) == (session, video_id, route) and not s.bounded
+            ]
+            for old in superseded:
+                self.streams.discard(old)
+            self.streams.add(stream)
+        for old in superseded:
+            old.cancel()
+        return stream
+
+    def close(self, stream):
+        with self.lock:
+            self.streams.discard(stream)
+        stream.kill()
+
+    def cancel_all(self):
+        with self.lock:
+            streams = list(self.streams)
+            self.streams.clear()
+        for stream in streams:
+            stream.cancel()
+
+    def load(self):
+        """(streams directos, transcodificaciones en curso o en cola)"""
+        with self.lock:
+            routes = [stream.route for stream in self.streams]
+        transcodes = routes.count('compat')
+        return len(routes) - transcodes, transcodes
+
+    def snapshot(self):
+        """Streams activos agrupados por cliente"""
+        clients = {}
+        with self.lock:
+            streams = list(self.streams)
+        for stream in streams:
+            clients.setdefault(stream.client, []).append({
+                'video': stream.video_id,
+                'route': stream.route,
+                'seconds': round(time.time() - stream.started, 1),
+                'ffmpeg_pid': stream.process.pid if stream.process is not None else None
+            })
+        return clients
+
+
+class Metrics:
+    """Métricas estilo Prometheus con contadores por hilo (sin locks al escribir)"""
+
+    # Límites superiores de los histogramas
+    BUCKETS = {
+        'seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+        'bytes': (65536, 262144, 524288, 1048576, 4194304, 16777216, 67108864, 268435456)
+    }
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []        # (hilo, valores) de cada hilo que ha escrito
+        self.retired = {}       # Valores acumulados de hilos terminados
+        self.help = {}          # nombre -> (tipo, descripción, buckets)
+        self.gauges = {}        # Gauges que se fijan (no se suman por hilo)
+        self.lock = threading.Lock()
+
+    def describe(self, name, kind, text, buckets=None):
+        self.help[name] = (kind, text, buckets)
+
+    def shard(self):
         try:
-            cap = cv2.VideoCapture(video_path)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-            duration = frame_count / fps
-            cap.release()
-            
-            # Formatear duración
-            hours = int(duration // 3600)
-            minutes = int((duration % 3600) // 60)
-            
-            if hours > 0:
-                return f"{hours}h {minutes}min"
+            return self.local.values
+        except AttributeError:
+            values = {}
+            with self.lock:
+                # Los servidores con un hilo por petición crean muchos shards:
+                # los de hilos muertos se pliegan en `retired`
+                if len(self.shards) >= 64:
+                    self.retire_dead_shards()
+                self.shards.append((threading.current_thread(), values))
+            self.local.values = values
+            return values
+
+    def retire_dead_shards(self):
+        alive = []
+        for thread, values in self.shards:
+            if thread.is_alive():
+                alive.append((thread, values))
             else:
-                return f"{minutes} min"
-        except:
-            return "Unknown"
-    
-    def scan_content(self):
-        """Escanea las carpetas de contenido"""
-        print("🔍 Escaneando contenido...")
-        print(f"📁 Buscando en: {self.movies_folder}")
-        
-        # Escanear películas
-        self.content_db['movies'] = []
-        video_extensions = ('.mp4', '.mkv', '.avi', '.mov', '.webm', '.MP4', '.MKV', '.AVI', '.MOV')
-        
-        # Debug: mostrar archivos encontrados
-        all_files = os.listdir(self.movies_folder)
-        print(f"📄 Archivos en Movies: {all_files}")
-        
-        for file in all_files:
-            if file.endswith(video_extensions):
-                video_path = os.path.join(self.movies_folder, file)
-                video_id = hashlib.md5(file.encode()).hexdigest()[:8]
-                
-                print(f"✅ Video encontrado: {file}")
-                
-                # Generar thumbnail si no existe
-                thumb_path = os.path.join(self.thumbnails_folder, f"{video_id}.jpg")
-                if not os.path.exists(thumb_path):
-                    print(f"🎨 Generando thumbnail para: {file}")
-                    self.generate_thumbnail(video_path, thumb_path)
-                
-                movie = {
-                    'id': video_id,
-                    'title': os.path.splitext(file)[0].replace('_', ' ').title(),
-                    'file': file,
-                    'path': video_path,
-                    'thumbnail': f"/thumbnail/{video_id}.jpg",
-                    'duration': self.get_video_duration(video_path),
-                    'year': random.randint(2018, 2024),
-                    'rating': round(random.uniform(7.0, 9.5), 1),
-                    'match': random.randint(85, 99)
-                }
-                
-                self.content_db['movies'].append(movie)
-        
-        # Asignar a categorías aleatorias (simulación)
-        if self.content_db['movies']:
-            random.shuffle(self.content_db['movies'])
-            self.content_db['categories']['trending'] = self.content_db['movies'][:5]
-            self.content_db['categories']['new_releases'] = self.content_db['movies'][:3]
-        
-        print(f"✅ Encontradas {len(self.content_db['movies'])} películas")
-    
-    def setup_routes(self):
-        @self.app.route('/')
-        def index():
-            return render_template_string('''
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <meta name="color-scheme" content="dark">
-    <meta name="theme-color" content="#141414">
-    <title>StreamFlix</title>
-    <style>
-        /* Forzar modo oscuro para TVs */
-        :root {
-            color-scheme: dark;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        html {
-            background-color: #141414 !important;
-            background: #141414 !important;
-        }
-        
-        body {
-            font-family: 'Netflix Sans', -apple-system, BlinkMacSystemFont, sans-serif;
-            background-color: #141414 !important;
-            background: #141414 !important;
-            color: #ffffff !important;
-            overflow-x: hidden;
-            user-select: none;
-            min-height: 100vh;
-            -webkit-text-size-adjust: 100%;
-            -webkit-font-smoothing: antialiased;
-        }
-        
-        /* Forzar fondo oscuro en todos los elementos */
-        div, section, header, nav, article, aside, footer {
-            background-color: transparent !important;
-            color: #ffffff !important;
-        }
-        
-        /* Prevenir fondos blancos en TVs */
-        input, textarea, select, button {
-            background-color: rgba(0,0,0,0.8) !important;
-            color: #ffffff !important;
-            border: 1px solid #333 !important;
-        }
-        
-        /* Estilos adicionales para forzar modo oscuro en TVs */
-        @media screen {
-            html, body {
-                background: #141414 !important;
-                background-color: #141414 !important;
-            }
-        }
-        
-        /* Para TVs con WebKit antiguo */
-        @media screen and (-webkit-min-device-pixel-ratio:0) {
-            body {
-                background: #141414 !important;
-                -webkit-background-size: 100% 100%;
+                for key, value in values.items():
+                    self.retired[key] = self.retired.get(key, 0) + value
+        self.shards = alive
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        values = self.shard()
+        values[key] = values.get(key, 0) + amount
+
+    def dec(self, name, amount=1, **labels):
+        self.inc(name, -amount, **labels)
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """Registra una observación en un histograma"""
+        buckets = self.help[name][2]
+        for le in buckets:
+            if value <= le:
+                break
+        else:
+            le = '+Inf'
+        values = self.shard()
+        base = tuple(sorted(labels.items()))
+        for key, amount in (((name + '_bucket', base + (('le', le),)), 1),
+                            ((name + '_sum', base), value),
+                            ((name + '_count', base), 1)):
+            values[key] = values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            self.retire_dead_shards()
+            totals = dict(self.retired)
+            shards = [values for _, values in self.shards]
+        for values in shards:
+            # Copia antes de iterar: el hilo dueño puede estar escribiendo
+            for key, value in list(values.items()):
+                totals[key] = totals.get(key, 0) + value
+        totals.update(self.gauges)
+        return totals
+
+    def render(self):
+        """Exposición en formato de texto de Prometheus"""
+        totals = self.snapshot()
+        lines = []
+        for name, (kind, text, buckets) in sorted(self.help.items()):
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'histogram':
+                series = {}
+                for (key, labels), value in totals.items():
+                    if key == name + '_bucket':
+                        base = tuple(l for l in labels if l[0] != 'le')
+                        series.setdefault(base, {})[dict(labels)['le']] = value
+                for base, counts in sorted(series.items()):
+                    cumulative = 0
+                    for le in buckets + ('+Inf',):
+                        cumulative += counts.get(le, 0)
+                        lines.append(f'{name}_bucket{self.format_labels(base + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{self.format_labels(base)} {totals.get((name + "_sum", base), 0)}')
+                    lines.append(f'{name}_count{self.format_labels(base)} {totals.get((name + "_count", base), 0)}')
+            else:
+                # Filtrar antes de ordenar: los `le` de los histogramas mezclan números y '+Inf'
+                series = sorted((labels, value) for (key, labels), value in totals.items() if key == name)
+                for labels, value in series:
+                    lines.append(f'{name}{self.format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class RequestTrace:
+    """Spans de una petición de streaming (solo existe con el tracing activo)"""
+
+    def __init__(self, tracer, request_id, route, video_id):
+        self.tracer = tracer
+        self.request_id = request_id
+        self.route = route
+        self.args = {'request': request_id, 'route': route, 'video': video_id}
+        self.started = time.perf_counter()
+        self.first_byte = False
+        self.bytes = 0
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tracer.complete(name, started, time.perf_counter(), dict(self.args, **args))
+
+    def mark(self, name, started, **args):
+        """Span que empezó en `started` y termina ahora"""
+        self.tracer.complete(name, started, time.perf_counter(), dict(self.args, **args))
+
+    def instant(self, name, **args):
+        self.tracer.instant(name, dict(self.args, **args))
+
+    def chunk(self, started, size):
+        """Registra un bloque leído/enviado y el primer byte"""
+        now = time.perf_counter()
+        self.bytes += size
+        if not self.first_byte:
+            self.first_byte = True
+            self.instant('first_byte', ms=round((now - self.started) * 1000, 3))
+        self.tracer.complete('chunk', started, now, dict(self.args, bytes=size))
+
+    def finish(self, disconnected):
+        if disconnected:
+            self.instant('client_disconnect', bytes=self.bytes)
+        self.tracer.complete(self.route, self.started, time.perf_counter(), dict(self.args, bytes=self.bytes))
+
+
+class Tracer:
+    """Trazas en formato Chrome trace (chrome://tracing, Perfetto) y perfiles por muestreo"""
+
+    def __init__(self, enabled=False, max_events=200000, sample_interval=0.005):
+        self.enabled = enabled
+        self.events = collections.deque(maxlen=max_events)
+        self.profiles = {}      # nombre -> Counter de pilas muestreadas
+        self.sample_interval = sample_interval
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def request(self, route, video_id):
+        """Traza de una nueva petición, o None si el tracing está desactivado"""
+        if not self.enabled:
+            return None
+        return RequestTrace(self, next(self.ids), route, video_id)
+
+    def timestamp(self, moment):
+        return round((moment - self.origin) * 1000000, 1)
+
+    def complete(self, name, started, finished, args=None):
+        self.events.append({
+            'name': name, 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(),
+            'ts': self.timestamp(started), 'dur': round((finished - started) * 1000000, 1),
+            'args': args or {}
+        })
+
+    def instant(self, name, args=None):
+        self.events.append({
+            'name': name, 'ph': 'i', 's': 't', 'pid': self.pid, 'tid': threading.get_ident(),
+            'ts': self.timestamp(time.perf_counter()), 'args': args or {}
+        })
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """Muestrea la pila del hilo actual mientras dura el bloque"""
+        if not self.enabled:
+            yield
+            return
+
+        target = threading.get_ident()
+        samples = collections.Counter()
+        done = threading.Event()
+
+        def sampler():
+            while not done.wait(self.sample_interval):
+                frame = sys._current_frames().get(target)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                samples[';'.join(reversed(stack))] += 1
+
+        thread = threading.Thread(target=sampler, daemon=True)
+        started = time.perf_counter()
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+            with self.lock:
+                self.profiles.setdefault(name, collections.Counter()).update(samples)
+            top = [{'stack': stack, 'samples': count} for stack, count in samples.most_common(10)]
+            self.complete(name, started, time.perf_counter(), {'samples': sum(samples.values()), 'top': top})
+
+    def export(self):
+        with self.lock:
+            profiles = {
+                name: [{'stack': stack, 'samples': count} for stack, count in counter.most_common(50)]
+                for name, counter in self.profiles.items()
             }
+        return {
+            'traceEvents': list(self.events),
+            'displayTimeUnit': 'ms',
+            'profiles': profiles
         }
+
+    def clear(self):
+        self.events.clear()
+        with self.lock:
+            self.profiles.clear()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.export(), f)
+
+
+class Volume:
+    """Volumen de almacenamiento con su propio pool de E/S y límite de concurrencia"""
+
+    # Operaciones de E/S simultáneas por defecto según el tipo de almacenamiento
+    TIER_CONCURRENCY = {
+        'ssd': 8,
+        'hdd': 2,
+        'nas': 4
+    }
+
+    def __init__(self, name, tier='ssd', concurrency=None, device=None):
+        self.name = name
+        self.tier = tier
+        self.device = device
+        self.concurrency = concurrency or self.TIER_CONCURRENCY.get(tier, 4)
+        self.io_slots = threading.BoundedSemaphore(self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f'io-{name}')
+
+    def read(self, f, size):
+        """Lee del archivo respetando el límite de E/S del volumen"""
+        with self.io_slots:
+            return f.read(size)
+
+
+def fingerprint_file(path, size, samples=3, block=65536):
+    """Huella barata del contenido: tamaño + bloques muestreados a lo largo del archivo"""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= block * samples:
+            digest.update(f.read())
+        else:
+            for i in range(samples):
+                f.seek((size - block) * i // (samples - 1))
+                digest.update(f.read(block))
+    return digest.hexdigest()
+
+
+def parse_library_root(spec):
+    """Convierte 'RUTA[:TIPO[:N]]' en la configuración de una raíz de biblioteca"""
+    root = {'path': spec}
+    parts = spec.rsplit(':', 2)
+    while len(parts) > 1:
+        if parts[-1].isdigit() and 'concurrency' not in root and 'tier' not in root:
+            root['concurrency'] = int(parts.pop())
+        elif parts[-1] in Volume.TIER_CONCURRENCY and 'tier' not in root:
+            root['tier'] = parts.pop()
+        else:
+            break
+        root['path'] = ':'.join(parts)
+    return root
+
+
+class HotCache:
+    """Caché de lectura en un disco rápido para los títulos más vistos de volúmenes lentos"""
+
+    def __init__(self, folder, max_bytes, min_plays=2, save_interval=30):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.save_interval = save_interval
+        self.manifest_path = os.path.join(folder, 'manifest.json')
+        self.entries = {}   # video_id -> {'file', 'source', 'size', 'mtime'}
+        self.plays = {}     # video_id -> {'count', 'last'}
+        self.copying = set()
+        self.version = 0
+        self.saved = time.monotonic()
+        self.saved_version = 0  # Versión ya escrita en disco (no reescribir sin cambios)
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()   # Escrituras del manifiesto en orden
+        # Una sola copia a la vez para no saturar el volumen lento
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hot-cache')
+        os.makedirs(folder, exist_ok=True)
+        self.device = os.stat(folder).st_dev
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.plays = data.get('plays', {})
+        except (OSError, ValueError):
+            pass
+        # Descartar copias a medias o entradas cuyo archivo ya no existe
+        for video_id, entry in list(self.entries.items()):
+            if not os.path.exists(os.path.join(self.folder, entry['file'])):
+                del self.entries[video_id]
+        for name in os.listdir(self.folder):
+            if name.endswith('.part'):
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+
+    def save(self):
+        # Dos peticiones simultáneas no deben compartir el archivo temporal
+        with self.save_lock:
+            with self.lock:
+                if self.version == self.saved_version:
+                    return
+                self.saved_version = self.version
+                data = json.dumps({'entries': self.entries, 'plays': self.plays})
+                self.saved = time.monotonic()
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def used_bytes(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def score(self, video_id):
+        """Prioridad de un título: más reproducciones, y a igualdad, más reciente (LFU + LRU)"""
+        plays = self.plays.get(video_id, {})
+        return (plays.get('count', 0), plays.get('last', 0))
+
+    def record_play(self, movie, volume):
+        """Cuenta una reproducción y programa la copia si el título lo merece"""
+        video_id = movie.id
+        with self.lock:
+            plays = self.plays.setdefault(video_id, {'count': 0, 'last': 0})
+            plays['count'] += 1
+            plays['last'] = time.time()
+            self.version += 1
+            # Copiar dentro del mismo dispositivo no acelera nada y gasta espacio
+            wanted = (
+                volume is not None and volume.tier != 'ssd'
+                and volume.device != self.device
+                and plays['count'] >= self.min_plays
+                and video_id not in self.entries
+                and video_id not in self.copying
+            )
+            if wanted:
+                self.copying.add(video_id)
+            # El manifiesto crece con cada título visto: se reescribe como mucho cada
+            # save_interval (y al terminar una copia y al salir), no en cada petición
+            due = time.monotonic() - self.saved > self.save_interval
+        if wanted:
+            self.executor.submit(self.copy, movie, volume)
+        elif due:
+            self.save()
+
+    def lookup(self, movie):
+        """Ruta de la copia en caché si sigue siendo fiel al original, si no None"""
+        entry = self.entries.get(movie.id)
+        if entry is None:
+            return None
+        cached_path = os.path.join(self.folder, entry['file'])
+        try:
+            source = os.stat(movie.path)
+            cached_size = os.path.getsize(cached_path)
+        except OSError:
+            cached_size = None
+        if cached_size is None or (source.st_size, source.st_mtime) != (entry['size'], entry['mtime']) \
+                or cached_size != entry['size']:
+            # El original cambió (o la copia se perdió): invalidar
+            self.remove(movie.id)
+            return None
+        return cached_path
+
+    def remove(self, video_id):
+        with self.lock:
+            entry = self.entries.pop(video_id, None)
+            if entry is not None:
+                self.version += 1
+        if entry is not None:
+            try:
+                os.remove(os.path.join(self.folder, entry['file']))
+            except OSError:
+                pass
+
+    def make_room(self, video_id, size):
+        """Expulsa los títulos menos valiosos; False si el nuevo no merece entrar"""
+        if size > self.max_bytes:
+            return False
+        with self.lock:
+            victims = sorted(self.entries, key=self.score)
+            needed = self.used_bytes + size - self.max_bytes
+            evict = []
+            for victim in victims:
+                if needed <= 0:
+                    break
+                if self.score(victim) >= self.score(video_id):
+                    return False
+                evict.append(victim)
+                needed -= self.entries[victim]['size']
+            if needed > 0:
+                return False
+        for victim in evict:
+            print(f"🧹 Caché: expulsando {victim}")
+            self.remove(victim)
+        return True
+
+    def copy(self, movie, volume):
+        video_id = movie.id
+        tmp_path = None
+        try:
+            before = os.stat(movie.path)
+            if not self.make_room(video_id, before.st_size):
+                return
+
+            name = video_id + os.path.splitext(movie.path)[1].lower()
+            tmp_path = os.path.join(self.folder, name + '.part')
+            print(f"📦 Caché: copiando {movie.file}")
+            with open(movie.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    data = volume.read(src, 1048576)
+                    if not data:
+                        break
+                    dst.write(data)
+
+            # Comprobar que el original no cambió durante la copia
+            after = os.stat(movie.path)
+            if (after.st_size, after.st_mtime) != (before.st_size, before.st_mtime) \
+                    or os.path.getsize(tmp_path) != before.st_size:
+                return
+            os.replace(tmp_path, os.path.join(self.folder, name))
+            tmp_path = None
+            with self.lock:
+                self.entries[video_id] = {
+                    'file': name,
+                    'source': movie.path,
+                    'size': before.st_size,
+                    'mtime': before.st_mtime
+                }
+                self.version += 1
+        except OSError as e:
+            print(f"⚠️ Caché: no se pudo copiar {movie.file}: {e}")
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            with self.lock:
+                self.copying.discard(video_id)
+            self.save()
+
+
+class PopularityTracker:
+    """Popularidad de los títulos con decaimiento exponencial y top-K por categoría
+
+    Decaimiento "hacia delante": un evento en el instante t suma
+    peso * 2^((t - landmark) / half_life). Las puntuaciones nunca bajan y el
+    orden entre títulos es el mismo que con el decaimiento clásico, así que
+    cada evento solo mueve a un título y el top-K de sus categorías se
+    actualiza en O(log K), sin recalcular nada más.
+    """
+
+    RESCALE_AFTER = 64      # Semividas antes de mover el landmark (evita desbordar floats)
+    PLAY = 1.0              # Peso de pulsar play
+    WATCHED = 2.0           # Peso de ver el título entero (proporcional a los bytes servidos)
+
+    def __init__(self, path, half_life=3 * 86400, top_k=40, save_interval=30):
+        self.path = path
+        self.half_life = half_life
+        self.top_k = top_k
+        self.save_interval = save_interval
+        self.landmark = time.time()
+        self.scores = {}        # video_id -> puntuación (en unidades del landmark)
+        self.categories = {}    # video_id -> categorías del título
+        self.tops = {}          # categoría -> {video_id: puntuación} (como mucho top_k)
+        self.heaps = {}         # categoría -> [(puntuación, video_id)], con entradas obsoletas
+        self.version = 0
+        self.saved = time.monotonic()
+        self.saved_version = 0  # Versión ya escrita en disco (no reescribir sin cambios)
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.landmark = data['landmark']
+            for video_id, (score, categories) in data['titles'].items():
+                self.scores[video_id] = score
+                self.categories[video_id] = tuple(categories)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self.rebuild()
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                if self.version == self.saved_version:
+                    return
+                self.saved_version = self.version
+                data = json.dumps({
+                    'landmark': self.landmark,
+                    'titles': {video_id: [score, self.categories.get(video_id, ())]
+                               for video_id, score in self.scores.items()}
+                })
+                self.saved = time.monotonic()
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️ No se pudo guardar la popularidad: {e}")
+
+    def rebuild(self):
+        """Reconstruye los top-K desde las puntuaciones (al cargar, reetiquetar o reescalar)"""
+        self.tops = {}
+        by_category = {}
+        for video_id, categories in self.categories.items():
+            score = self.scores.get(video_id)
+            if score:
+                for category in categories:
+                    by_category.setdefault(category, []).append((score, video_id))
+        for category, entries in by_category.items():
+            top = heapq.nlargest(self.top_k, entries)
+            self.tops[category] = {video_id: score for score, video_id in top}
+        self.heaps = {category: [(score, video_id) for video_id, score in top.items()]
+                      for category, top in self.tops.items()}
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    def retag(self, categories):
+        """Categorías actuales de cada título tras un escaneo; los ausentes salen de los top-K"""
+        with self.lock:
+            self.categories = dict(categories)
+            self.rebuild()
+            self.version += 1
+
+    def record(self, video_id, weight=1.0, now=None):
+        """Suma un evento (reproducción o fracción vista) a la popularidad del título"""
+        now = time.time() if now is None else now
+        with self.lock:
+            exponent = (now - self.landmark) / self.half_life
+            if exponent > self.RESCALE_AFTER:
+                self.rescale(now)
+                exponent = 0.0
+            score = self.scores.get(video_id, 0.0) + weight * 2.0 ** exponent
+            self.scores[video_id] = score
+            for category in self.categories.get(video_id, ()):
+                self.promote(category, video_id, score)
+            self.version += 1
+            due = time.monotonic() - self.saved > self.save_interval
+        if due:
+            self.save()
+
+    def promote(self, category, video_id, score):
+        """Actualiza el top-K de una categoría tras subir la puntuación de un título"""
+        top = self.tops.setdefault(category, {})
+        heap = self.heaps.setdefault(category, [])
+        if video_id not in top and len(top) >= self.top_k:
+            # Mínimo vigente del top-K: las entradas obsoletas se descartan al llegar arriba
+            while top.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            if score <= heap[0][0]:
+                return
+            del top[heapq.heappop(heap)[1]]
+        top[video_id] = score
+        heapq.heappush(heap, (score, video_id))   # La entrada anterior del título queda obsoleta
+        if len(heap) > 4 * self.top_k:
+            heap[:] = [(value, key) for key, value in top.items()]
+            heapq.heapify(heap)
+
+    def rescale(self, now):
+        """Mueve el landmark a `now` dividiendo todas las puntuaciones (poco frecuente)"""
+        factor = 2.0 ** (-(now - self.landmark) / self.half_life)
+        self.scores = {video_id: score * factor for video_id, score in self.scores.items()}
+        self.landmark = now
+        self.rebuild()
+
+    def top(self, category):
+        """Ids del top-K de la categoría, del más al menos popular"""
+        with self.lock:
+            top = self.tops.get(category, {})
+            return [video_id for video_id, _ in sorted(top.items(), key=lambda item: -item[1])]
+
+
+# Miniaturas por imagen de sprite y tamaño de cada una (ver generate_thumbnail)
+SPRITE_TILES = 48
+SPRITE_TILE_SIZE = (355, 200)
+
+
+class SpriteCache:
+    """Sprites ya codificados, limitados en bytes y expulsados por LRU
+
+    La fila "todas" cubre el catálogo entero: sin límite acabaría en memoria
+    cada página de cada formato.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()   # (fila, página, formato) -> (versión, bytes)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None or cached[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return cached[1]
+
+    def put(self, key, version, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (version, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class StaticAsset:
+    """Recurso estático compilado al arrancar, con variantes gzip/brotli y ETag"""
+
+    def __init__(self, name, body, mimetype, fast=False):
+        self.body = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.mimetype = mimetype
+        digest = hashlib.sha256(self.body).hexdigest()
+        self.etag = digest[:16]
+        stem, ext = os.path.splitext(name)
+        self.name = f'{stem}.{digest[:10]}{ext}'   # Nombre con huella del contenido
+
+        # `fast`: compresión moderada para cuerpos grandes que se regeneran (catálogo)
+        self.encodings = {'gzip': gzip.compress(self.body, 6 if fast else 9, mtime=0)}
+        try:
+            import brotli
+            self.encodings['br'] = brotli.compress(self.body, quality=5 if fast else 11)
+        except ImportError:
+            pass
+
+
+class Movie:
+    """Ficha de un título como registro compacto (__slots__, sin dict por instancia)
+
+    `path` y `thumbnail` se derivan de los demás campos y las cadenas que se
+    repiten entre títulos (raíz, volumen, duración, género) se internan.
+    """
+    __slots__ = ('id', 'title', 'file', 'root', 'volume', 'duration', 'year', 'genre', 'added', 'duplicates')
+
+    def __init__(self, id, title, file, root, volume, duration, year, genre=None, added=0.0, duplicates=None):
+        self.id = id
+        self.title = title
+        self.file = file                    # Relativo a la raíz, con '/'
+        self.root = sys.intern(root)
+        self.volume = sys.intern(volume)
+        self.duration = sys.intern(duration)
+        self.year = year
+        self.genre = genre and sys.intern(genre)
+        self.added = added                  # mtime del archivo (para novedades)
+        self.duplicates = duplicates        # Rutas de copias idénticas (tupla) o None
+
+    @property
+    def path(self):
+        return os.path.join(self.root, *self.file.split('/'))
+
+    @property
+    def thumbnail(self):
+        return f"/thumbnail/{self.id}.jpg"
+
+    def to_json(self):
+        """Objeto JSON del título tal como lo espera el front-end"""
+        fields = {
+            'id': self.id,
+            'title': self.title,
+            'file': self.file,
+            'path': self.path,
+            'root': self.root,
+            'volume': self.volume,
+            'thumbnail': self.thumbnail,
+            'duration': self.duration,
+            'year': self.year,
+            'genre': self.genre
+        }
+        if self.duplicates:
+            fields['duplicates'] = self.duplicates
+        return json.dumps(fields, sort_keys=True, separators=(',', ':'))
+
+
+GENRES = ('action', 'comedy', 'drama', 'scifi', 'horror')
+CATALOG_CATEGORIES = ('trending', 'new_releases') + GENRES
+ROW_LIMIT = 40          # Títulos por fila de la portada
+ROWS_MAX_AGE = 5        # Segundos que pueden servirse filas sin los últimos eventos
+
+# Carpetas que dan género a los títulos que contienen (p. ej. Movies/Terror/...)
+GENRE_FOLDERS = {
+    'action': 'action', 'accion': 'action', 'acción': 'action',
+    'comedy': 'comedy', 'comedia': 'comedy',
+    'drama': 'drama',
+    'scifi': 'scifi', 'sci-fi': 'scifi', 'science fiction': 'scifi',
+    'ciencia ficcion': 'scifi', 'ciencia ficción': 'scifi',
+    'horror': 'horror', 'terror': 'horror'
+}
+
+
+def write_json(write, value):
+    """Escribe `value` como JSON con claves ordenadas; los Movie con su propio to_json()"""
+    if isinstance(value, Movie):
+        write(value.to_json())
+    elif isinstance(value, dict):
+        write('{')
+        for i, key in enumerate(sorted(value)):
+            write((',' if i else '') + json.dumps(key) + ':')
+            write_json(write, value[key])
+        write('}')
+    elif isinstance(value, (list, tuple)):
+        write('[')
+        for i, item in enumerate(value):
+            if i:
+                write(',')
+            write_json(write, item)
+        write(']')
+    else:
+        write(json.dumps(value, sort_keys=True, separators=(',', ':')))
+
+
+def render_json(value):
+    """JSON en bytes escrito título a título, sin el árbol de dicts intermedio"""
+    out = io.BytesIO()
+    write_json(lambda text: out.write(text.encode('utf-8')), value)
+    return out.getvalue()
+
+
+class Catalog:
+    """Instantánea inmutable del catálogo
+
+    Cada escaneo construye una nueva y la publica con una sola asignación
+    (StreamFlix.catalog). Los lectores toman la referencia una vez y trabajan
+    con ella sin bloqueos aunque entretanto se publique otra versión.
+    """
+
+    def __init__(self, version, movies=(), sprite_rows=None, sprites=None):
+        self.version = version
+        self.movies = tuple(movies)
+        self.by_id = {movie.id: movie for movie in self.movies}
+        self.sprite_rows = sprite_rows or {}
+        # Huella de los ids: dos nodos con la misma sirven los mismos títulos
+        self.digest = hashlib.blake2b(','.join(sorted(self.by_id)).encode(), digest_size=8).hexdigest()
+
+        # Índices de las filas de la portada: más recientes primero
+        newest = sorted(self.movies, key=lambda movie: movie.added, reverse=True)
+        self.newest = tuple(newest[:ROW_LIMIT])
+        self.genres = {}
+        for movie in newest:
+            if movie.genre:
+                self.genres.setdefault(movie.genre, []).append(movie)
+
+        self.content = {
+            'version': version,
+            'movies': self.movies,
+            'series': (),
+            'continue_watching': (),
+            'sprites': sprites or {}
+        }
+        # /api/content no cambia dentro de una versión: se serializa y comprime una vez
+        self.asset = StaticAsset('content.json', render_json(self.content), 'application/json', fast=True)
+
+    def get(self, video_id):
+        return self.by_id.get(video_id)
+
+
+class HomeRows:
+    """Filas de la portada para una versión del catálogo y de la popularidad
+
+    Son pocas decenas de títulos: se regeneran aparte del catálogo (que no se
+    vuelve a serializar) y se publican igual, con una sola asignación.
+    """
+
+    def __init__(self, key, categories, sprite_rows, sprites):
+        self.key = key                      # (versión del catálogo, versión de la popularidad)
+        self.built = time.monotonic()
+        self.sprite_rows = sprite_rows
+        self.asset = StaticAsset('categories.json', render_json({
+            'version': f'{key[0]}.{key[1]}',
+            'categories': categories,
+            'sprites': sprites
+        }), 'application/json', fast=True)
+
+
+class PeerDirectory:
+    """Otros nodos StreamFlix de la LAN con la misma biblioteca (modo peer)
+
+    Cada nodo anuncia por multicast UDP su URL, su carga (streams y ffmpeg)
+    y la huella de su catálogo. Si la huella de un peer no coincide con la
+    local, sus ids se piden una vez por HTTP (/api/peer/titles) para saber
+    qué títulos puede servir.
+    """
+
+    ANNOUNCE_INTERVAL = 2.0
+    PEER_TIMEOUT = 7.0      # Sin anuncios en este tiempo, el peer se da por caído
+    TRANSCODE_COST = 4      # Un ffmpeg pesa como varios streams directos
+    GROUP = '239.255.88.99' # Grupo multicast de descubrimiento (ámbito local)
+
+    def __init__(self, url, status, port=8899, targets=None, cluster='streamflix', advertised=False):
+        self.node_id = os.urandom(6).hex()
+        self.url = url
+        self.advertised = advertised    # URL dada a mano (--advertise): su host puede no ser el emisor
+        self.status = status    # Callable: {'streams', 'transcodes', 'capacity', 'catalog'}
+        self.port = port
+        self.targets = tuple(targets or (self.GROUP,))
+        self.cluster = cluster
+        self.peers = {}         # node_id -> {'url', 'load', 'catalog', 'titles', 'seen'}
+        self.lock = threading.Lock()
+
+        self.check_targets(self.targets)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.bind(('', port))
+        try:
+            membership = socket.inet_aton(self.GROUP) + socket.inet_aton('0.0.0.0')
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            print(f"⚠️ No se pudo unir al grupo multicast {self.GROUP}: {e}")
+
+    @classmethod
+    def check_targets(cls, targets):
+        """Rechaza destinos unicast locales"""
+        # Varios nodos en la misma máquina comparten el puerto (SO_REUSEPORT) y Linux
+        # entrega cada datagrama unicast a uno solo de esos sockets; multicast y
+        # broadcast llegan a todos
+        for target in targets:
+            if target == 'localhost' or target.startswith('127.'):
+                raise ValueError(f'--announce-to {target}: con varios nodos en la misma máquina solo uno '
+                                 f'recibiría los anuncios; usa multicast ({cls.GROUP}) o broadcast')
+
+    def start(self):
+        threading.Thread(target=self.listen, name='peer-listen', daemon=True).start()
+        threading.Thread(target=self.announce_loop, name='peer-announce', daemon=True).start()
+
+    @classmethod
+    def load_score(cls, status):
+        """Carga normalizada por capacidad: streams + ffmpeg ponderados"""
+        return (status['streams'] + cls.TRANSCODE_COST * status['transcodes']) / max(1, status['capacity'])
+
+    def announce_loop(self):
+        while True:
+            self.announce()
+            time.sleep(self.ANNOUNCE_INTERVAL)
+
+    def announce(self):
+        status = self.status()
+        message = json.dumps({
+            'cluster': self.cluster,
+            'node': self.node_id,
+            'url': self.url,
+            'advertised': self.advertised,
+            'load': self.load_score(status),
+            'catalog': status['catalog']
+        }).encode('utf-8')
+        for target in self.targets:
+            try:
+                self.sock.sendto(message, (target, self.port))
+            except OSError as e:
+                print(f"⚠️ No se pudo anunciar el nodo en {target}: {e}")
+
+    def listen(self):
+        from urllib.parse import urlsplit
         
-        /* Prevenir flash blanco al cargar */
-        html:not(.loaded) * {
-            animation-duration: 0s !important;
-            transition: none !important;
-        }
-        
-        /* Scrollbar personalizada */
-        ::-webkit-scrollbar {
-            width: 8px;
-        }
-        
-        ::-webkit-scrollbar-track {
-            background: #141414;
-        }
-        
-        ::-webkit-scrollbar-thumb {
-            background: #555;
-            border-radius: 4px;
-        }
-        
-        /* Header */
-        .header {
-            position: fixed;
-            top: 0;
-            width: 100%;
-            padding: 20px 50px;
-            background: linear-gradient(to bottom, rgba(0,0,0,0.9) 0%, transparent 100%);
-            z-index: 1000;
-            transition: all 0.3s ease;
-        }
-        
-        .header.scrolled {
-            background: #141414;
-            padding: 15px 50px;
-        }
-        
-        .nav {
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-        }
-        
-        .logo {
-            font-size: 32px;
-            font-weight: bold;
-            color: #e50914;
-            text-transform: uppercase;
-            letter-spacing: 2px;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-        }
-        
-        .nav-links {
-            display: flex;
-            gap: 30px;
-            list-style: none;
-        }
-        
-        .nav-links a {
-            color: #e5e5e5;
-            text-decoration: none;
-            font-size: 14px;
-            transition: color 0.3s;
-        }
-        
-        .nav-links a:hover {
-            color: #fff;
-        }
-        
-        /* Hero Section */
-        .hero {
-            position: relative;
-            height: 80vh;
-            min-height: 600px;
-            display: flex;
-            align-items: center;
-            overflow: hidden;
-        }
-        
-        .hero-bg {
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            z-index: -1;
-        }
-        
-        .hero-bg img {
-            width: 100%;
-            height: 100%;
-            object-fit: cover;
-            filter: brightness(0.5);
-        }
-        
-        .hero-gradient {
-            position: absolute;
-            bottom: 0;
-            left: 0;
-            width: 100%;
-            height: 50%;
-            background: linear-gradient(to top, #141414 0%, transparent 100%);
-        }
-        
-        .hero-content {
-            padding: 0 50px;
-            max-width: 600px;
-            z-index: 1;
-        }
-        
-        .hero-title {
-            font-size: 64px;
-            font-weight: bold;
-            margin-bottom: 20px;
-            text-shadow: 3px 3px 6px rgba(0,0,0,0.8);
-            animation: fadeInUp 0.8s ease;
-        }
-        
-        .hero-description {
-            font-size: 20px;
-            line-height: 1.6;
-            margin-bottom: 30px;
-            color: #e5e5e5;
-            animation: fadeInUp 0.8s ease 0.2s both;
-        }
-        
-        .hero-buttons {
-            display: flex;
-            gap: 15px;
-            animation: fadeInUp 0.8s ease 0.4s both;
-        }
-        
-        .btn {
-            padding: 12px 30px;
-            border: none;
-            border-radius: 4px;
-            font-size: 18px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            text-decoration: none;
-        }
-        
-        .btn-primary {
-            background: #fff;
-            color: #000;
-        }
-        
-        .btn-primary:hover {
-            background: #e5e5e5;
-            transform: scale(1.05);
-        }
-        
-        .btn-secondary {
-            background: rgba(109, 109, 110, 0.7);
-            color: #fff;
-            backdrop-filter: blur(4px);
-        }
-        
-        .btn-secondary:hover {
-            background: rgba(109, 109, 110, 0.9);
-            transform: scale(1.05);
-        }
-        
-        /* Content Sections */
-        .content-section {
-            padding: 0 50px;
-            margin-bottom: 50px;
-        }
-        
-        .section-title {
-            font-size: 24px;
-            margin-bottom: 20px;
-            font-weight: 600;
-        }
-        
-        /* Carousel */
-        .carousel-container {
-            position: relative;
-            margin: 0 -50px;
-            padding: 0 50px;
-            overflow: hidden;
-        }
-        
-        .carousel {
-            display: flex;
-            gap: 8px;
-            overflow-x: auto;
-            scroll-behavior: smooth;
-            scrollbar-width: none;
-            -ms-overflow-style: none;
-            padding-bottom: 10px;
-        }
-        
-        .carousel::-webkit-scrollbar {
-            display: none;
-        }
-        
-        .carousel-item {
-            flex: 0 0 auto;
-            width: 250px;
-            cursor: pointer;
-            transition: transform 0.3s ease;
-            position: relative;
-            border-radius: 4px;
-            overflow: hidden;
-        }
-        
-        .carousel-item:hover {
-            transform: scale(1.3);
-            z-index: 10;
-        }
-        
-        .carousel-item:hover .item-info {
-            opacity: 1;
-        }
-        
-        .carousel-item img {
-            width: 100%;
-            height: 140px;
-            object-fit: cover;
-            border-radius: 4px;
-        }
-        
-        .item-info {
-            position: absolute;
-            bottom: 0;
-            left: 0;
-            right: 0;
-            padding: 20px 15px 15px;
-            background: linear-gradient(to top, rgba(0,0,0,0.9) 0%, transparent 100%);
-            opacity: 0;
-            transition: opacity 0.3s ease;
-        }
-        
-        .item-title {
-            font-size: 14px;
-            font-weight: 600;
-            margin-bottom: 5px;
-        }
-        
-        .item-meta {
-            display: flex;
-            gap: 10px;
-            font-size: 12px;
-            color: #46d369;
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65536)
+                message = json.loads(data)
+                if message.get('cluster') != self.cluster or message.get('node') == self.node_id:
+                    continue
+                node_id, catalog = message['node'], message['catalog']
+                # La URL se entrega a los clientes: debe apuntar al propio emisor,
+                # salvo que este la haya fijado con --advertise
+                url = urlsplit(message['url'])
+                if url.scheme not in ('http', 'https') or not url.hostname:
+                    continue
+                if url.hostname != addr[0] and not message.get('advertised'):
+                    continue
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                continue
+            local_catalog = self.status()['catalog']
+            now = time.monotonic()
+            with self.lock:
+                peer = self.peers.get(node_id)
+                if peer is None:
+                    print(f"🖧 Nuevo nodo: {message['url']}")
+                    peer = self.peers[node_id] = {'catalog': None, 'titles': None, 'fetched': 0}
+                if peer['catalog'] != catalog:
+                    peer['titles'], peer['fetched'] = None, 0
+                peer.update(url=message['url'], load=float(message['load']), catalog=catalog, seen=now)
+                # Catálogo distinto: pedir sus ids (reintentando si el peer aún no respondía)
+                fetch = catalog != local_catalog and peer['titles'] is None and now - peer['fetched'] > self.PEER_TIMEOUT
+                if fetch:
+                    peer['fetched'] = now
+            if fetch:
+                threading.Thread(target=self.fetch_titles, args=(node_id, message['url'], catalog), daemon=True).start()
+
+    def fetch_titles(self, node_id, url, catalog):
+        """Ids que sirve un peer con un catálogo distinto del local"""
+        import urllib.request
+        try:
+            with urllib.request.urlopen(url + '/api/peer/titles', timeout=5) as response:
+                data = json.load(response)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ No se pudo leer el catálogo de {url}: {e}")
+            return
+        with self.lock:
+            peer = self.peers.get(node_id)
+            if peer is not None and peer['catalog'] == catalog == data.get('catalog'):
+                peer['titles'] = frozenset(data.get('ids', ()))
+
+    def live_peers(self):
+        now = time.monotonic()
+        with self.lock:
+            for node_id in [n for n, peer in self.peers.items() if now - peer['seen'] > self.PEER_TIMEOUT]:
+                print(f"🖧 Nodo caído: {self.peers[node_id]['url']}")
+                del self.peers[node_id]
+            return dict(self.peers)
+
+    def pick(self, video_id, local_status, local_has_title):
+        """Peer menos cargado que puede servir el título, o None si conviene servirlo aquí"""
+        best, best_load = None, self.load_score(local_status) if local_has_title else float('inf')
+        for node_id, peer in self.live_peers().items():
+            can_serve = peer['catalog'] == local_status['catalog'] or (peer['titles'] and video_id in peer['titles'])
+            if can_serve and peer['load'] < best_load:
+                best, best_load = node_id, peer['load']
+        if best is None:
+            return None
+        with self.lock:
+            peer = self.peers.get(best)
+            if peer is None:
+                return None
+            # Hasta su próximo anuncio, contar aquí el stream que le mandamos
+            peer['load'] += 1 / max(1, local_status['capacity'])
+            return dict(peer, node=best)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            'node': self.node_id,
+            'url': self.url,
+            'peers': [{
+                'node': node_id,
+                'url': peer['url'],
+                'load': round(peer['load'], 3),
+                'catalog': peer['catalog'],
+                'titles': None if peer['titles'] is None else len(peer['titles']),
+                'seen': round(now - peer['seen'], 1)
+            } for node_id, peer in self.live_peers().items()]
         }
-        
-        .item-controls {
-            display: flex;
-            gap: 8px;
-            margin-top: 10px;
+
+
+# Página principal: el HTML, el CSS y el JS se compilan una vez al arrancar
+# (ver StreamFlix.build_assets) y se sirven precomprimidos
+INDEX_HTML = '''<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <meta name="color-scheme" content="dark">
+    <meta name="theme-color" content="#141414">
+    <title>StreamFlix</title>
+    <link rel="stylesheet" href="__APP_CSS__">
+    <script>
+        // Marcar cuando esté cargado
+        window.addEventListener('load', () => {
+            document.documentElement.classList.add('loaded');
+        });
+    </script>
+</head>
+<body>
+    <!-- Header -->
+    <header class="header" id="header">
+        <nav class="nav">
+            <div class="logo">StreamFlix</div>
+            <ul class="nav-links">
+                <li><a href="#home">Inicio</a></li>
+                <li><a href="#movies">Películas</a></li>
+                <li><a href="#series">Series</a></li>
+                <li><a href="#mylist">Mi Lista</a></li>
+            </ul>
+        </nav>
+    </header>
+    
+    <!-- Hero Section -->
+    <section class="hero">
+        <div class="hero-bg">
+            <img src="https://source.unsplash.com/1600x900/?movie,cinema" alt="Hero">
+        </div>
+        <div class="hero-gradient"></div>
+        <div class="hero-content">
+            <h1 class="hero-title">Bienvenido a StreamFlix</h1>
+            <p class="hero-description">Tu biblioteca personal de streaming. Disfruta de todas tus películas y series favoritas en cualquier dispositivo.</p>
+            <div class="hero-buttons">
+                <button class="btn btn-primary" onclick="playRandom()">
+                    <span>▶</span> Reproducir
+                </button>
+                <button class="btn btn-secondary" onclick="showInfo()">
+                    <span>ⓘ</span> Más información
+                </button>
+            </div>
+        </div>
+    </section>
+    
+    <!-- Content Sections -->
+    <div id="content-wrapper">
+        <!-- Se llenará dinámicamente -->
+    </div>
+    
+    <!-- Video Player Overlay -->
+    <div class="video-overlay" id="videoOverlay">
+        <div class="video-container">
+            <button class="close-video" onclick="closeVideo()">×</button>
+            <video id="videoPlayer" controls></video>
+            <div class="video-controls">
+                <!-- Controles personalizados aquí si quieres -->
+            </div>
+        </div>
+    </div>
+    
+    <!-- Loading -->
+    <div class="loading" id="loading">
+        <div class="spinner"></div>
+    </div>
+    
+    <script src="__APP_JS__"></script>
+</body>
+</html>
+'''
+
+INDEX_CSS = '''/* Forzar modo oscuro para TVs */
+:root {
+    color-scheme: dark;
+}
+
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+html {
+    background-color: #141414 !important;
+    background: #141414 !important;
+}
+
+body {
+    font-family: 'Netflix Sans', -apple-system, BlinkMacSystemFont, sans-serif;
+    background-color: #141414 !important;
+    background: #141414 !important;
+    color: #ffffff !important;
+    overflow-x: hidden;
+    user-select: none;
+    min-height: 100vh;
+    -webkit-text-size-adjust: 100%;
+    -webkit-font-smoothing: antialiased;
+}
+
+/* Forzar fondo oscuro en todos los elementos */
+div, section, header, nav, article, aside, footer {
+    background-color: transparent !important;
+    color: #ffffff !important;
+}
+
+/* Prevenir fondos blancos en TVs */
+input, textarea, select, button {
+    background-color: rgba(0,0,0,0.8) !important;
+    color: #ffffff !important;
+    border: 1px solid #333 !important;
+}
+
+/* Estilos adicionales para forzar modo oscuro en TVs */
+@media screen {
+    html, body {
+        background: #141414 !important;
+        background-color: #141414 !important;
+    }
+}
+
+/* Para TVs con WebKit antiguo */
+@media screen and (-webkit-min-device-pixel-ratio:0) {
+    body {
+        background: #141414 !important;
+        -webkit-background-size: 100% 100%;
+    }
+}
+
+/* Prevenir flash blanco al cargar */
+html:not(.loaded) * {
+    animation-duration: 0s !important;
+    transition: none !important;
+}
+
+/* Scrollbar personalizada */
+::-webkit-scrollbar {
+    width: 8px;
+}
+
+::-webkit-scrollbar-track {
+    background: #141414;
+}
+
+::-webkit-scrollbar-thumb {
+    background: #555;
+    border-radius: 4px;
+}
+
+/* Header */
+.header {
+    position: fixed;
+    top: 0;
+    width: 100%;
+    padding: 20px 50px;
+    background: linear-gradient(to bottom, rgba(0,0,0,0.9) 0%, transparent 100%);
+    z-index: 1000;
+    transition: all 0.3s ease;
+}
+
+.header.scrolled {
+    background: #141414;
+    padding: 15px 50px;
+}
+
+.nav {
+    display: flex;
+    align-items: center;
+    justify-content: space-between;
+}
+
+.logo {
+    font-size: 32px;
+    font-weight: bold;
+    color: #e50914;
+    text-transform: uppercase;
+    letter-spacing: 2px;
+    text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
+}
+
+.nav-links {
+    display: flex;
+    gap: 30px;
+    list-style: none;
+}
+
+.nav-links a {
+    color: #e5e5e5;
+    text-decoration: none;
+    font-size: 14px;
+    transition: color 0.3s;
+}
+
+.nav-links a:hover {
+    color: #fff;
+}
+
+/* Hero Section */
+.hero {
+    position: relative;
+    height: 80vh;
+    min-height: 600px;
+    display: flex;
+    align-items: center;
+    overflow: hidden;
+}
+
+.hero-bg {
+    position: absolute;
+    top: 0;
+    left: 0;
+    width: 100%;
+    height: 100%;
+    z-index: -1;
+}
+
+.hero-bg img {
+    width: 100%;
+    height: 100%;
+    object-fit: cover;
+    filter: brightness(0.5);
+}
+
+.hero-gradient {
+    position: absolute;
+    bottom: 0;
+    left: 0;
+    width: 100%;
+    height: 50%;
+    background: linear-gradient(to top, #141414 0%, transparent 100%);
+}
+
+.hero-content {
+    padding: 0 50px;
+    max-width: 600px;
+    z-index: 1;
+}
+
+.hero-title {
+    font-size: 64px;
+    font-weight: bold;
+    margin-bottom: 20px;
+    text-shadow: 3px 3px 6px rgba(0,0,0,0.8);
+    animation: fadeInUp 0.8s ease;
+}
+
+.hero-description {
+    font-size: 20px;
+    line-height: 1.6;
+    margin-bottom: 30px;
+    color: #e5e5e5;
+    animation: fadeInUp 0.8s ease 0.2s both;
+}
+
+.hero-buttons {
+    display: flex;
+    gap: 15px;
+    animation: fadeInUp 0.8s ease 0.4s both;
+}
+
+.btn {
+    padding: 12px 30px;
+    border: none;
+    border-radius: 4px;
+    font-size: 18px;
+    font-weight: 600;
+    cursor: pointer;
+    transition: all 0.3s ease;
+    display: flex;
+    align-items: center;
+    gap: 10px;
+    text-decoration: none;
+}
+
+.btn-primary {
+    background: #fff;
+    color: #000;
+}
+
+.btn-primary:hover {
+    background: #e5e5e5;
+    transform: scale(1.05);
+}
+
+.btn-secondary {
+    background: rgba(109, 109, 110, 0.7);
+    color: #fff;
+    backdrop-filter: blur(4px);
+}
+
+.btn-secondary:hover {
+    background: rgba(109, 109, 110, 0.9);
+    transform: scale(1.05);
+}
+
+/* Content Sections */
+.content-section {
+    padding: 0 50px;
+    margin-bottom: 50px;
+}
+
+.section-title {
+    font-size: 24px;
+    margin-bottom: 20px;
+    font-weight: 600;
+}
+
+/* Carousel */
+.carousel-container {
+    position: relative;
+    margin: 0 -50px;
+    padding: 0 50px;
+    overflow: hidden;
+}
+
+.carousel {
+    display: flex;
+    gap: 8px;
+    overflow-x: auto;
+    scroll-behavior: smooth;
+    scrollbar-width: none;
+    -ms-overflow-style: none;
+    padding-bottom: 10px;
+}
+
+.carousel::-webkit-scrollbar {
+    display: none;
+}
+
+.carousel-item {
+    flex: 0 0 auto;
+    width: 250px;
+    cursor: pointer;
+    transition: transform 0.3s ease;
+    position: relative;
+    border-radius: 4px;
+    overflow: hidden;
+}
+
+.carousel-item:hover {
+    transform: scale(1.3);
+    z-index: 10;
+}
+
+.carousel-item:hover .item-info {
+    opacity: 1;
+}
+
+.carousel-item img {
+    width: 100%;
+    height: 140px;
+    object-fit: cover;
+    border-radius: 4px;
+}
+
+/* Miniatura recortada del sprite de la fila */
+.carousel-item .item-thumb {
+    width: 100%;
+    height: 140px;
+    border-radius: 4px;
+    background-color: #222 !important;
+    background-repeat: no-repeat;
+}
+
+.item-info {
+    position: absolute;
+    bottom: 0;
+    left: 0;
+    right: 0;
+    padding: 20px 15px 15px;
+    background: linear-gradient(to top, rgba(0,0,0,0.9) 0%, transparent 100%);
+    opacity: 0;
+    transition: opacity 0.3s ease;
+}
+
+.item-title {
+    font-size: 14px;
+    font-weight: 600;
+    margin-bottom: 5px;
+}
+
+.item-meta {
+    display: flex;
+    gap: 10px;
+    font-size: 12px;
+    color: #46d369;
+}
+
+.item-controls {
+    display: flex;
+    gap: 8px;
+    margin-top: 10px;
+}
+
+.control-btn {
+    width: 32px;
+    height: 32px;
+    border-radius: 50%;
+    border: 2px solid rgba(255,255,255,0.7);
+    background: rgba(0,0,0,0.5);
+    color: #fff;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    cursor: pointer;
+    transition: all 0.3s ease;
+}
+
+.control-btn:hover {
+    background: #fff;
+    color: #000;
+    border-color: #fff;
+}
+
+/* Video Player Overlay */
+.video-overlay {
+    position: fixed;
+    top: 0;
+    left: 0;
+    width: 100%;
+    height: 100%;
+    background: #000;
+    z-index: 2000;
+    display: none;
+    opacity: 0;
+    transition: opacity 0.3s ease;
+}
+
+.video-overlay.active {
+    display: flex;
+    opacity: 1;
+}
+
+.video-container {
+    width: 100%;
+    height: 100%;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    position: relative;
+}
+
+video {
+    width: 100%;
+    height: 100%;
+    max-width: 100%;
+    max-height: 100%;
+}
+
+.video-controls {
+    position: absolute;
+    bottom: 0;
+    left: 0;
+    right: 0;
+    padding: 20px;
+    background: linear-gradient(to top, rgba(0,0,0,0.8) 0%, transparent 100%);
+    display: flex;
+    align-items: center;
+    gap: 20px;
+    opacity: 0;
+    transition: opacity 0.3s ease;
+}
+
+.video-container:hover .video-controls {
+    opacity: 1;
+}
+
+.close-video {
+    position: absolute;
+    top: 20px;
+    right: 20px;
+    width: 40px;
+    height: 40px;
+    background: rgba(0,0,0,0.7);
+    border: none;
+    border-radius: 50%;
+    color: #fff;
+    font-size: 24px;
+    cursor: pointer;
+    transition: all 0.3s ease;
+    z-index: 10;
+}
+
+.close-video:hover {
+    background: #e50914;
+    transform: scale(1.1);
+}
+
+/* Loading Animation */
+.loading {
+    position: fixed;
+    top: 50%;
+    left: 50%;
+    transform: translate(-50%, -50%);
+    display: none;
+}
+
+.loading.active {
+    display: block;
+}
+
+.spinner {
+    width: 60px;
+    height: 60px;
+    border: 3px solid rgba(255,255,255,0.3);
+    border-top-color: #e50914;
+    border-radius: 50%;
+    animation: spin 1s linear infinite;
+}
+
+@keyframes spin {
+    to { transform: rotate(360deg); }
+}
+
+@keyframes fadeInUp {
+    from {
+        opacity: 0;
+        transform: translateY(30px);
+    }
+    to {
+        opacity: 1;
+        transform: translateY(0);
+    }
+}
+
+/* Responsive */
+@media (max-width: 768px) {
+    .header, .content-section {
+        padding: 15px 20px;
+    }
+
+    .hero-title {
+        font-size: 36px;
+    }
+
+    .hero-description {
+        font-size: 16px;
+    }
+
+    .carousel-item {
+        width: 150px;
+    }
+
+    .carousel-item img,
+    .carousel-item .item-thumb {
+        height: 85px;
+    }
+
+    .nav-links {
+        display: none;
+    }
+}
+'''
+
+INDEX_JS = '''let contentData = {};
+
+// Detectar scroll para header
+window.addEventListener('scroll', () => {
+    const header = document.getElementById('header');
+    if (window.scrollY > 50) {
+        header.classList.add('scrolled');
+    } else {
+        header.classList.remove('scrolled');
+    }
+});
+
+const GENRE_TITLES = {
+    action: 'Acción',
+    comedy: 'Comedia',
+    drama: 'Drama',
+    scifi: 'Ciencia ficción',
+    horror: 'Terror'
+};
+
+// Cargar contenido: catálogo completo y filas de la portada (por popularidad real)
+async function loadContent() {
+    try {
+        const [content, rows] = await Promise.all([
+            fetch('/api/content').then(response => response.json()),
+            fetch('/api/categories').then(response => response.json())
+        ]);
+        contentData = content;
+        applyRows(rows);
+        renderContent();
+    } catch (error) {
+        console.error('Error loading content:', error);
+    }
+}
+
+function applyRows(rows) {
+    contentData.categories = rows.categories;
+    contentData.sprites = Object.assign({}, contentData.sprites, rows.sprites);
+}
+
+// Las filas cambian con lo que se ve: refrescarlas al volver a la portada
+async function refreshRows() {
+    try {
+        const response = await fetch('/api/categories');
+        applyRows(await response.json());
+        renderContent();
+    } catch (error) {
+        console.error('Error loading categories:', error);
+    }
+}
+
+// Renderizar contenido
+function renderContent() {
+    const wrapper = document.getElementById('content-wrapper');
+    let html = '';
+
+    // Trending
+    if (contentData.categories.trending.length > 0) {
+        html += createSection('Tendencias', contentData.categories.trending, 'trending');
+    }
+
+    // All Movies
+    if (contentData.movies.length > 0) {
+        html += createSection('Todas las Películas', contentData.movies, 'movies');
+    }
+
+    // New Releases
+    if (contentData.categories.new_releases.length > 0) {
+        html += createSection('Nuevos Lanzamientos', contentData.categories.new_releases, 'new_releases');
+    }
+
+    // Géneros (carpetas de la biblioteca)
+    for (const [genre, title] of Object.entries(GENRE_TITLES)) {
+        const items = contentData.categories[genre] || [];
+        if (items.length > 0) {
+            html += createSection(title, items, genre);
         }
-        
-        .control-btn {
-            width: 32px;
-            height: 32px;
-            border-radius: 50%;
-            border: 2px solid rgba(255,255,255,0.7);
-            background: rgba(0,0,0,0.5);
-            color: #fff;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            cursor: pointer;
-            transition: all 0.3s ease;
+    }
+
+    wrapper.innerHTML = html;
+}
+
+// Miniatura: recorte del sprite de la fila (una imagen por página de miniaturas)
+function thumbnailMarkup(item, index, sprite) {
+    if (!sprite) {
+        return `<img src="${item.thumbnail}" alt="${item.title}" onerror="this.src='https://via.placeholder.com/250x140/222/666?text=${encodeURIComponent(item.title)}'">`;
+    }
+
+    const page = Math.floor(index / sprite.per_page);
+    const tiles = Math.min(sprite.per_page, sprite.count - page * sprite.per_page);
+    const y = tiles > 1 ? (index % sprite.per_page) / (tiles - 1) * 100 : 0;
+    const url = `/thumbnail/sprite/${sprite.row}/${page}.jpg?v=${sprite.version}`;
+    return `<div class="item-thumb" role="img" aria-label="${item.title}" style="background-image: url('${url}'); background-size: 100% ${tiles * 100}%; background-position: 0 ${y}%"></div>`;
+}
+
+// Crear sección
+function createSection(title, items, row) {
+    const sprite = (contentData.sprites || {})[row];
+    let html = `
+        <section class="content-section">
+            <h2 class="section-title">${title}</h2>
+            <div class="carousel-container">
+                <div class="carousel">
+    `;
+
+    items.forEach((item, index) => {
+        html += `
+            <div class="carousel-item" onclick="playVideo('${item.id}')">
+                ${thumbnailMarkup(item, index, sprite)}
+                <div class="item-info">
+                    <h3 class="item-title">${item.title}</h3>
+                    <div class="item-meta">
+                        <span>${GENRE_TITLES[item.genre] || ''}</span>
+                        <span>${item.year || ''}</span>
+                        <span>${item.duration}</span>
+                    </div>
+                    <div class="item-controls">
+                        <div class="control-btn" onclick="event.stopPropagation(); playVideo('${item.id}')">▶</div>
+                        <div class="control-btn" onclick="event.stopPropagation(); addToList('${item.id}')">+</div>
+                        <div class="control-btn" onclick="event.stopPropagation(); likeVideo('${item.id}')">👍</div>
+                    </div>
+                </div>
+            </div>
+        `;
+    });
+
+    html += `
+                </div>
+            </div>
+        </section>
+    `;
+
+    return html;
+}
+
+// Estado del reproductor: en modo compatible el stream lo genera ffmpeg desde `offset`
+const playback = { compat: false, compatUrl: null, offset: 0, absolute: true, reloading: false };
+
+// Posición real en la película (algunos navegadores ignoran el desfase de timestamps)
+function playbackPosition(player) {
+    return playback.absolute ? player.currentTime : playback.offset + player.currentTime;
+}
+
+// Arrancar el stream compatible en `seconds`: ffmpeg empieza en el keyframe previo
+function loadCompat(player, seconds) {
+    playback.compat = true;
+    playback.offset = Math.max(0, seconds);
+    playback.reloading = true;
+    player.src = playback.offset > 0 ? `${playback.compatUrl}&t=${playback.offset.toFixed(3)}` : playback.compatUrl;
+    player.load();
+    player.play().catch(() => {});
+}
+
+function isBuffered(player, time) {
+    for (let i = 0; i < player.buffered.length; i++) {
+        if (time >= player.buffered.start(i) && time <= player.buffered.end(i)) return true;
+    }
+    return false;
+}
+
+function setupPlayer(player) {
+    // Si el navegador no puede decodificar el original, pasar al stream transcodificado
+    player.addEventListener('error', () => {
+        if (!playback.compat && playback.compatUrl && player.getAttribute('src')) {
+            loadCompat(player, player.currentTime);
         }
-        
-        .control-btn:hover {
-            background: #fff;
-            color: #000;
-            border-color: #fff;
+    });
+
+    player.addEventListener('loadeddata', () => {
+        playback.absolute = player.buffered.length > 0 && player.buffered.start(0) >= playback.offset - 1;
+        playback.reloading = false;
+    });
+
+    // El stream compatible no admite rangos: saltar fuera de lo cargado relanza ffmpeg con ?t=
+    player.addEventListener('seeking', () => {
+        if (playback.compat && !playback.reloading && !isBuffered(player, player.currentTime)) {
+            loadCompat(player, playbackPosition(player));
         }
-        
-        /* Video Player Overlay */
-        .video-overlay {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: #000;
-            z-index: 2000;
-            display: none;
-            opacity: 0;
-            transition: opacity 0.3s ease;
+    });
+
+    document.addEventListener('keydown', (event) => {
+        if (!document.getElementById('videoOverlay').classList.contains('active')) return;
+        const step = { ArrowLeft: -10, ArrowRight: 10 }[event.key];
+        if (!step) return;
+        event.preventDefault();
+        const target = Math.max(0, playbackPosition(player) + step);
+        if (playback.compat && !isBuffered(player, playback.absolute ? target : target - playback.offset)) {
+            loadCompat(player, target);
+        } else {
+            player.currentTime = playback.absolute ? target : target - playback.offset;
+        }
+    });
+}
+
+// Reproducir video
+async function playVideo(videoId) {
+    const loading = document.getElementById('loading');
+    loading.classList.add('active');
+
+    try {
+        const response = await fetch(`/api/play/${videoId}`);
+        const data = await response.json();
+
+        const overlay = document.getElementById('videoOverlay');
+        const player = document.getElementById('videoPlayer');
+
+        Object.assign(playback, { compat: false, compatUrl: data.compat_url, offset: 0, absolute: true, reloading: false });
+
+        // Configurar player para TVs
+        player.setAttribute('playsinline', '');
+        player.setAttribute('webkit-playsinline', '');
+        player.setAttribute('x-webkit-airplay', 'allow');
+
+        // Detectar si es TV y ajustar
+        const isTV = /tv|smart|tizen|webos|roku|hbbtv/i.test(navigator.userAgent);
+        if (isTV) {
+            player.setAttribute('controls', 'controls');
+            // Algunos TVs necesitan un delay
+            setTimeout(() => {
+                player.src = data.url;
+                player.load();
+                player.play().catch(e => {
+                    console.log('Autoplay bloqueado, reproducir manualmente');
+                });
+            }, 100);
+        } else {
+            player.src = data.url;
+            player.play();
         }
+
+        overlay.classList.add('active');
+    } catch (error) {
+        console.error('Error playing video:', error);
+        alert('Error al reproducir el video');
+    } finally {
+        loading.classList.remove('active');
+    }
+}
+
+// Cerrar video
+function closeVideo() {
+    const overlay = document.getElementById('videoOverlay');
+    const player = document.getElementById('videoPlayer');
+
+    player.pause();
+    Object.assign(playback, { compat: false, compatUrl: null, offset: 0 });
+    player.removeAttribute('src');
+    player.load();
+    overlay.classList.remove('active');
+    refreshRows();
+}
+
+// Reproducir aleatorio
+function playRandom() {
+    if (contentData.movies && contentData.movies.length > 0) {
+        const random = contentData.movies[Math.floor(Math.random() * contentData.movies.length)];
+        playVideo(random.id);
+    }
+}
+
+// Funciones placeholder
+function showInfo() {
+    alert('StreamFlix - Tu streaming personal\\n\\nColoca tus videos en las carpetas Movies y Series');
+}
+
+function addToList(videoId) {
+    console.log('Añadido a la lista:', videoId);
+}
+
+function likeVideo(videoId) {
+    console.log('Like:', videoId);
+}
+
+// Cargar al inicio
+setupPlayer(document.getElementById('videoPlayer'));
+loadContent();
+'''
+
+
+class StreamFlix:
+    def __init__(self, base_folder=None, trace=False, headless=False, library_roots=None,
+                 cache_folder=None, cache_max_bytes=20 * 1024 ** 3, port=8888,
+                 peer_mode=False, advertise_url=None, discovery_port=8899, announce_to=None,
+                 global_rate=None, client_rate=None, connection_rate=None):
+        from flask import Flask
+        from flask_cors import CORS
         
-        .video-overlay.active {
-            display: flex;
-            opacity: 1;
-        }
+        self.app = Flask(__name__)
+        CORS(self.app)
         
-        .video-container {
-            width: 100%;
-            height: 100%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            position: relative;
-        }
+        # Configuración
+        # En modo servidor (headless) no se sondea la red ni se abren ventanas
+        self.headless = headless
+        self.host = '0.0.0.0' if headless else self.get_local_ip()
+        self.port = port
         
-        video {
-            width: 100%;
-            height: 100%;
-            max-width: 100%;
-            max-height: 100%;
-        }
+        # Límites de ancho de banda en bytes/s (None = sin límite)
+        self.shaper = BandwidthShaper(
+            global_rate=global_rate,            # Total del servidor
+            client_rate=client_rate,            # Por IP de cliente
+            connection_rate=connection_rate     # Por conexión
+        )
         
-        .video-controls {
-            position: absolute;
-            bottom: 0;
-            left: 0;
-            right: 0;
-            padding: 20px;
-            background: linear-gradient(to top, rgba(0,0,0,0.8) 0%, transparent 100%);
-            display: flex;
-            align-items: center;
-            gap: 20px;
-            opacity: 0;
-            transition: opacity 0.3s ease;
-        }
+        # Streams activos por cliente (para cortar lecturas y ffmpeg huérfanos)
+        self.streams = StreamRegistry()
+        atexit.register(self.streams.cancel_all)
         
-        .video-container:hover .video-controls {
-            opacity: 1;
-        }
+        # Métricas (/metrics)
+        self.metrics = Metrics()
+        self.describe_metrics()
         
-        .close-video {
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            width: 40px;
-            height: 40px;
-            background: rgba(0,0,0,0.7);
-            border: none;
-            border-radius: 50%;
-            color: #fff;
-            font-size: 24px;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            z-index: 10;
-        }
+        # Trazas por petición (/api/debug/trace), desactivadas por defecto
+        self.tracer = Tracer(enabled=trace)
         
-        .close-video:hover {
-            background: #e50914;
-            transform: scale(1.1);
-        }
+        # Transcodificaciones ffmpeg simultáneas (el resto espera en cola)
+        self.max_transcodes = os.cpu_count() or 2
+        self.transcode_slots = threading.BoundedSemaphore(self.max_transcodes)
         
-        /* Loading Animation */
-        .loading {
-            position: fixed;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            display: none;
-        }
+        # Carpetas de contenido
+        self.base_folder = base_folder or os.path.join(os.path.expanduser("~"), "StreamFlix")
+        self.movies_folder = os.path.join(self.base_folder, "Movies")
+        self.series_folder = os.path.join(self.base_folder, "Series")
+        self.thumbnails_folder = os.path.join(self.base_folder, ".thumbnails")
         
-        .loading.active {
-            display: block;
-        }
+        # Crear carpetas
+        for folder in [self.movies_folder, self.series_folder, self.thumbnails_folder]:
+            os.makedirs(folder, exist_ok=True)
         
-        .spinner {
-            width: 60px;
-            height: 60px;
-            border: 3px solid rgba(255,255,255,0.3);
-            border-top-color: #e50914;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-        }
+        # Raíces de la biblioteca: rutas o dicts {'path', 'tier', 'concurrency'}
+        self.library_roots = []
+        for root in library_roots or [self.movies_folder]:
+            if isinstance(root, str):
+                root = {'path': root}
+            self.library_roots.append(dict(root, path=os.path.abspath(os.path.expanduser(root['path']))))
+        
+        # Un volumen (pool de E/S) por dispositivo físico
+        self.volumes = {}
+        self.root_volumes = {}
+        for root in self.library_roots:
+            self.root_volumes[root['path']] = self.get_volume(root)
+        
+        # Ids por huella de contenido, cacheados por ruta/tamaño/mtime
+        self.ids_path = os.path.join(self.thumbnails_folder, "ids.json")
+        self.id_cache = {}
+        self.id_cache_lock = threading.Lock()
+        try:
+            with open(self.ids_path) as f:
+                self.id_cache = json.load(f)
+        except (OSError, ValueError):
+            pass
+        
+        # Caché en disco rápido para títulos populares de volúmenes lentos
+        cache_folder = cache_folder or os.path.join(self.base_folder, ".cache")
+        self.hot_cache = HotCache(cache_folder, cache_max_bytes)
+        atexit.register(self.hot_cache.save)
+        self.cache_volume = self.get_volume({'path': cache_folder, 'tier': 'ssd'})
+        if self.cache_volume.tier != 'ssd':
+            print(f"⚠️ La caché rápida ({cache_folder}) está en el mismo dispositivo que un volumen "
+                  f"{self.cache_volume.tier}: no se copiará nada. Usa --cache-dir en un SSD aparte")
+        
+        # Catálogo publicado (instantánea inmutable) y escaneos serializados
+        self.catalog = Catalog(0)
+        self.scan_lock = threading.Lock()
+        
+        # Popularidad real (play y bytes vistos) y filas de la portada derivadas
+        self.popularity = PopularityTracker(os.path.join(self.thumbnails_folder, "popularity.json"), top_k=ROW_LIMIT)
+        atexit.register(self.popularity.save)
+        self.rows = HomeRows((0, 0), {}, {}, {})
+        self.rows_lock = threading.Lock()
+        
+        # Variantes WebP/AVIF de las miniaturas, en segundo plano
+        self.thumbnail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnails')
+        
+        # Sprites de miniaturas por fila del carrusel
+        self.sprite_cache = SpriteCache()
+        
+        # Escanear contenido (en segundo plano en modo headless)
+        self.scan_ready = threading.Event()
+        if headless:
+            threading.Thread(target=self.scan_content, daemon=True).start()
+        else:
+            self.scan_content()
+        
+        # Compilar la página principal y configurar rutas
+        self.build_assets()
+        self.setup_routes()
         
-        @keyframes spin {
-            to { transform: rotate(360deg); }
+        # Modo peer: otros nodos de la LAN con la misma biblioteca se reparten los streams
+        self.peers = None
+        if peer_mode:
+            host = self.get_local_ip() if self.host == '0.0.0.0' else self.host
+            self.peers = PeerDirectory(advertise_url or f"http://{host}:{self.port}", self.node_status,
+                                       port=discovery_port, targets=announce_to,
+                                       advertised=advertise_url is not None)
+            self.peers.start()
+    
+    def get_local_ip(self):
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            ip = s.getsockname()[0]
+            s.close()
+            return ip
+        except:
+            return "127.0.0.1"
+    
+    def node_status(self):
+        """Carga de este nodo tal como se anuncia a los peers"""
+        streams, transcodes = self.streams.load()
+        return {
+            'streams': streams,
+            'transcodes': transcodes,
+            'capacity': self.max_transcodes,
+            'catalog': self.catalog.digest
         }
+    
+    def describe_metrics(self):
+        m = self.metrics
+        m.describe('streamflix_bytes_served_total', 'counter', 'Bytes enviados por ruta')
+        m.describe('streamflix_active_streams', 'gauge', 'Streams activos por ruta')
+        m.describe('streamflix_range_request_bytes', 'histogram', 'Tamaño de los rangos pedidos', Metrics.BUCKETS['bytes'])
+        m.describe('streamflix_time_to_first_byte_seconds', 'histogram', 'Tiempo hasta el primer byte por ruta', Metrics.BUCKETS['seconds'])
+        m.describe('streamflix_scan_file_seconds', 'histogram', 'Tiempo de escaneo por archivo', Metrics.BUCKETS['seconds'])
+        m.describe('streamflix_scan_duration_seconds', 'gauge', 'Duración del último escaneo completo')
+        m.describe('streamflix_library_titles', 'gauge', 'Títulos en la biblioteca')
+        m.describe('streamflix_catalog_version', 'gauge', 'Versión de la instantánea del catálogo publicada')
+        m.describe('streamflix_play_redirects_total', 'counter', 'Reproducciones enviadas a otro nodo')
+        m.describe('streamflix_thumbnail_seconds', 'histogram', 'Latencia de generación de miniaturas', Metrics.BUCKETS['seconds'])
+        m.describe('streamflix_ffmpeg_active', 'gauge', 'Procesos ffmpeg en ejecución')
+        m.describe('streamflix_ffmpeg_queued', 'gauge', 'Transcodificaciones esperando un hueco')
+    
+    def instrument_stream(self, chunks, route, started, on_finish=None):
+        """Envuelve un generador de bloques con métricas de bytes, TTFB y streams activos"""
+        metrics = self.metrics
+        metrics.inc('streamflix_active_streams', route=route)
+        sent = 0
+        try:
+            first = True
+            for chunk in chunks:
+                if first:
+                    metrics.observe('streamflix_time_to_first_byte_seconds', time.monotonic() - started, route=route)
+                    first = False
+                metrics.inc('streamflix_bytes_served_total', len(chunk), route=route)
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.dec('streamflix_active_streams', route=route)
+            if on_finish is not None:
+                on_finish(sent)
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+    
+    def get_stream_priority(self, is_tv):
+        """Clase de prioridad de la petición actual para el limitador"""
+        from flask import request
+        
+        purpose = (request.headers.get('Sec-Purpose', '') + request.headers.get('Purpose', '')).lower()
+        if 'prefetch' in purpose or request.args.get('prefetch'):
+            return 'prefetch'
+        return 'tv' if is_tv else 'browser'
+    
+    def open_throttle(self, is_tv):
+        """Limitador para el stream de la petición actual (None si no hay límites)"""
+        from flask import request
         
-        @keyframes fadeInUp {
-            from {
-                opacity: 0;
-                transform: translateY(30px);
-            }
-            to {
-                opacity: 1;
-                transform: translateY(0);
-            }
-        }
+        return self.shaper.open(request.remote_addr, self.get_stream_priority(is_tv))
+    
+    def get_volume(self, root):
+        """Volumen de una raíz; las raíces del mismo dispositivo lo comparten"""
+        try:
+            device = os.stat(root['path']).st_dev
+        except OSError:
+            device = root['path']
+        for volume in self.volumes.values():
+            if volume.device == device:
+                return volume
+        
+        tier = root.get('tier', 'ssd')
+        volume = Volume(f'vol{len(self.volumes)}-{tier}', tier, root.get('concurrency'), device)
+        self.volumes[volume.name] = volume
+        return volume
+    
+    def open_stream(self, video_id, route):
+        """Registra el stream de la petición actual (sustituye al abierto de la misma sesión)"""
+        from flask import request
         
-        /* Responsive */
-        @media (max-width: 768px) {
-            .header, .content-section {
-                padding: 15px 20px;
-            }
-            
-            .hero-title {
-                font-size: 36px;
-            }
-            
-            .hero-description {
-                font-size: 16px;
-            }
-            
-            .carousel-item {
-                width: 150px;
-            }
-            
-            .carousel-item img {
-                height: 85px;
-            }
-            
-            .nav-links {
-                display: none;
-            }
-        }
-    </style>
-    <script>
-        // Marcar cuando esté cargado
-        window.addEventListener('load', () => {
-            document.documentElement.classList.add('loaded');
-        });
-    </script>
-</head>
-<body>
-    <!-- Header -->
-    <header class="header" id="header">
-        <nav class="nav">
-            <div class="logo">StreamFlix</div>
-            <ul class="nav-links">
-                <li><a href="#home">Inicio</a></li>
-                <li><a href="#movies">Películas</a></li>
-                <li><a href="#series">Series</a></li>
-                <li><a href="#mylist">Mi Lista</a></li>
-            </ul>
-        </nav>
-    </header>
+        bounded = re.search(r'bytes=\d+-\d+', request.headers.get('Range', '')) is not None
+        return self.streams.open(request.remote_addr, video_id, route, request.environ.get('werkzeug.socket'),
+                                 request.args.get('session'), bounded)
     
-    <!-- Hero Section -->
-    <section class="hero">
-        <div class="hero-bg">
-            <img src="https://source.unsplash.com/1600x900/?movie,cinema" alt="Hero">
-        </div>
-        <div class="hero-gradient"></div>
-        <div class="hero-content">
-            <h1 class="hero-title">Bienvenido a StreamFlix</h1>
-            <p class="hero-description">Tu biblioteca personal de streaming. Disfruta de todas tus películas y series favoritas en cualquier dispositivo.</p>
-            <div class="hero-buttons">
-                <button class="btn btn-primary" onclick="playRandom()">
-                    <span>▶</span> Reproducir
-                </button>
-                <button class="btn btn-secondary" onclick="showInfo()">
-                    <span>ⓘ</span> Más información
-                </button>
-            </div>
-        </div>
-    </section>
+    def watch_transcode(self, stream, process):
+        """Mata ffmpeg en cuanto el cliente se desconecta o el stream se sustituye
+
+        El hueco de transcodificación se libera aquí, al terminar el proceso, y no
+        en el generador: este puede quedarse bloqueado escribiendo a un cliente
+        que ya no lee.
+        """
+        try:
+            while process.poll() is None:
+                if not stream.alive():
+                    stream.kill()
+                    break
+                stream.cancelled.wait(ActiveStream.LIVENESS_INTERVAL)
+            process.wait()
+        finally:
+            self.metrics.dec('streamflix_ffmpeg_active')
+            self.transcode_slots.release()
     
-    <!-- Content Sections -->
-    <div id="content-wrapper">
-        <!-- Se llenará dinámicamente -->
-    </div>
+    def iter_file(self, video_path, byte_start, length, throttle=None, trace=None, volume=None, stream=None):
+        """Lee `length` bytes del archivo desde `byte_start` en bloques de 64KB"""
+        if trace is not None:
+            with trace.span('file_open', offset=byte_start, length=length):
+                f = open(video_path, 'rb')
+                f.seek(byte_start)
+        else:
+            f = open(video_path, 'rb')
+            f.seek(byte_start)
+        
+        disconnected = False
+        try:
+            remaining = length
+            while remaining:
+                # Cliente desconectado o seek más reciente: dejar de leer disco
+                if stream is not None and not stream.alive():
+                    disconnected = True
+                    break
+                if trace is not None:
+                    chunk_started = time.perf_counter()
+                to_read = min(65536, remaining)
+                data = volume.read(f, to_read) if volume is not None else f.read(to_read)
+                if not data:
+                    break
+                remaining -= len(data)
+                if throttle is not None:
+                    throttle.consume(len(data), stream.cancelled if stream is not None else None)
+                if trace is not None:
+                    trace.chunk(chunk_started, len(data))
+                yield data
+        except GeneratorExit:
+            disconnected = True
+            raise
+        finally:
+            f.close()
+            if trace is not None:
+                trace.finish(disconnected)
     
-    <!-- Video Player Overlay -->
-    <div class="video-overlay" id="videoOverlay">
-        <div class="video-container">
-            <button class="close-video" onclick="closeVideo()">×</button>
-            <video id="videoPlayer" controls></video>
-            <div class="video-controls">
-                <!-- Controles personalizados aquí si quieres -->
-            </div>
-        </div>
-    </div>
+    def generate_thumbnail(self, video_path, output_path):
+        """Genera miniatura del video"""
+        with self.tracer.profile('generate_thumbnail'):
+            return self._generate_thumbnail(video_path, output_path)
     
-    <!-- Loading -->
-    <div class="loading" id="loading">
-        <div class="spinner"></div>
-    </div>
+    def _generate_thumbnail(self, video_path, output_path):
+        started = time.monotonic()
+        try:
+            cv2 = load_cv2()
+            frame = self.pick_thumbnail_frame(video_path)
+            if frame is not None:
+                # Guardar
+                cv2.imwrite(output_path, frame)
+                
+                # Variantes WebP/AVIF en segundo plano, a partir del frame original
+                self.thumbnail_executor.submit(self.write_thumbnail_variants, output_path, frame)
+            return True
+        except:
+            return False
+        finally:
+            self.metrics.observe('streamflix_thumbnail_seconds', time.monotonic() - started)
     
-    <script>
-        let contentData = {};
-        
-        // Detectar scroll para header
-        window.addEventListener('scroll', () => {
-            const header = document.getElementById('header');
-            if (window.scrollY > 50) {
-                header.classList.add('scrolled');
-            } else {
-                header.classList.remove('scrolled');
-            }
-        });
-        
-        // Cargar contenido
-        async function loadContent() {
-            try {
-                const response = await fetch('/api/content');
-                contentData = await response.json();
-                renderContent();
-            } catch (error) {
-                console.error('Error loading content:', error);
-            }
-        }
-        
-        // Renderizar contenido
-        function renderContent() {
-            const wrapper = document.getElementById('content-wrapper');
-            let html = '';
-            
-            // Trending
-            if (contentData.categories.trending.length > 0) {
-                html += createSection('Tendencias', contentData.categories.trending);
-            }
-            
-            // All Movies
-            if (contentData.movies.length > 0) {
-                html += createSection('Todas las Películas', contentData.movies);
-            }
-            
-            // New Releases
-            if (contentData.categories.new_releases.length > 0) {
-                html += createSection('Nuevos Lanzamientos', contentData.categories.new_releases);
-            }
-            
-            wrapper.innerHTML = html;
-        }
+    def pick_thumbnail_frame(self, video_path):
+        """Elige el mejor de varios frames candidatos, ya redimensionado a 16:9"""
+        import numpy as np
         
-        // Crear sección
-        function createSection(title, items) {
-            let html = `
-                <section class="content-section">
-                    <h2 class="section-title">${title}</h2>
-                    <div class="carousel-container">
-                        <div class="carousel">
-            `;
+        cv2 = load_cv2()
+        cap = cv2.VideoCapture(video_path)
+        try:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             
-            items.forEach(item => {
-                html += `
-                    <div class="carousel-item" onclick="playVideo('${item.id}')">
-                        <img src="${item.thumbnail}" alt="${item.title}" onerror="this.src='https://via.placeholder.com/250x140/222/666?text=${encodeURIComponent(item.title)}'">
-                        <div class="item-info">
-                            <h3 class="item-title">${item.title}</h3>
-                            <div class="item-meta">
-                                <span>${item.match}% coincidencia</span>
-                                <span>${item.year}</span>
-                                <span>${item.duration}</span>
-                            </div>
-                            <div class="item-controls">
-                                <div class="control-btn" onclick="event.stopPropagation(); playVideo('${item.id}')">▶</div>
-                                <div class="control-btn" onclick="event.stopPropagation(); addToList('${item.id}')">+</div>
-                                <div class="control-btn" onclick="event.stopPropagation(); likeVideo('${item.id}')">👍</div>
-                            </div>
-                        </div>
-                    </div>
-                `;
-            });
+            # Redimensionar a 16:9
+            height = 200
+            width = int(height * 16 / 9)
             
-            html += `
-                        </div>
-                    </div>
-                </section>
-            `;
+            candidates = []
+            small = []
+            for fraction in THUMBNAIL_CANDIDATES:
+                # El seek del backend FFmpeg es exacto: vuelve al keyframe previo y
+                # decodifica hasta el frame pedido (hasta un GOP por candidato; ver el
+                # benchmark de GOP largo). retrieve() solo convierte ese frame, que se
+                # reduce en el acto para puntuar sobre pocos píxeles
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(total_frames * fraction))
+                if not cap.grab():
+                    continue
+                ret, frame = cap.retrieve()
+                if not ret:
+                    continue
+                candidates.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+                small.append(cv2.cvtColor(cv2.resize(frame, SCORE_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY))
             
-            return html;
-        }
+            if not candidates:
+                return None
+            return candidates[int(np.argmax(score_frames(np.stack(small))))]
+        finally:
+            cap.release()
+    
+    def write_thumbnail_variants(self, jpeg_path, frame=None):
+        """Escribe las variantes WebP/AVIF de una miniatura si pesan menos que el JPEG"""
+        try:
+            cv2 = load_cv2()
+            if frame is None:
+                frame = cv2.imread(jpeg_path)
+                if frame is None:
+                    return
+            jpeg_size = os.path.getsize(jpeg_path)
+            stem = os.path.splitext(jpeg_path)[0]
+            for fmt in ('webp', 'avif'):
+                data = encode_image(frame, fmt)
+                if data is None or len(data) >= jpeg_size:
+                    # No compensa: que no quede una variante de una miniatura anterior
+                    if os.path.exists(f"{stem}.{fmt}"):
+                        os.remove(f"{stem}.{fmt}")
+                    continue
+                tmp_path = f"{stem}.{fmt}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, f"{stem}.{fmt}")
+        except Exception as e:
+            print(f"⚠️ No se pudieron generar variantes de {jpeg_path}: {e}")
+    
+    def accepted_image_formats(self):
+        """Formatos de imagen que el cliente declara explícitamente en Accept"""
+        from flask import request
         
-        // Reproducir video
-        async function playVideo(videoId) {
-            const loading = document.getElementById('loading');
-            loading.classList.add('active');
+        # Solo menciones explícitas: los TVs antiguos envían */* y no decodifican WebP
+        explicit = {value for value, quality in request.accept_mimetypes if quality > 0}
+        return [fmt for fmt, mimetype in IMAGE_FORMATS.items() if fmt == 'jpg' or mimetype in explicit]
+    
+    def get_video_duration(self, video_path):
+        """Obtiene duración del video"""
+        try:
+            cv2 = load_cv2()
+            cap = cv2.VideoCapture(video_path)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+            duration = frame_count / fps
+            cap.release()
             
-            try {
-                const response = await fetch(`/api/play/${videoId}`);
-                const data = await response.json();
-                
-                const overlay = document.getElementById('videoOverlay');
-                const player = document.getElementById('videoPlayer');
-                
-                // Configurar player para TVs
-                player.setAttribute('playsinline', '');
-                player.setAttribute('webkit-playsinline', '');
-                player.setAttribute('x-webkit-airplay', 'allow');
-                
-                // Detectar si es TV y ajustar
-                const isTV = /tv|smart|tizen|webos|roku|hbbtv/i.test(navigator.userAgent);
-                if (isTV) {
-                    player.setAttribute('controls', 'controls');
-                    // Algunos TVs necesitan un delay
-                    setTimeout(() => {
-                        player.src = data.url;
-                        player.load();
-                        player.play().catch(e => {
-                            console.log('Autoplay bloqueado, reproducir manualmente');
-                        });
-                    }, 100);
-                } else {
-                    player.src = data.url;
-                    player.play();
-                }
-                
-                overlay.classList.add('active');
-            } catch (error) {
-                console.error('Error playing video:', error);
-                alert('Error al reproducir el video');
-            } finally {
-                loading.classList.remove('active');
-            }
-        }
-        
-        // Cerrar video
-        function closeVideo() {
-            const overlay = document.getElementById('videoOverlay');
-            const player = document.getElementById('videoPlayer');
+            # Formatear duración
+            hours = int(duration // 3600)
+            minutes = int((duration % 3600) // 60)
             
-            player.pause();
-            player.src = '';
-            overlay.classList.remove('active');
-        }
-        
-        // Reproducir aleatorio
-        function playRandom() {
-            if (contentData.movies && contentData.movies.length > 0) {
-                const random = contentData.movies[Math.floor(Math.random() * contentData.movies.length)];
-                playVideo(random.id);
-            }
-        }
-        
-        // Funciones placeholder
-        function showInfo() {
-            alert('StreamFlix - Tu streaming personal\\n\\nColoca tus videos en las carpetas Movies y Series');
-        }
-        
-        function addToList(videoId) {
-            console.log('Añadido a la lista:', videoId);
-        }
+            if hours > 0:
+                return f"{hours}h {minutes}min"
+            else:
+                return f"{minutes} min"
+        except:
+            return "Unknown"
+    
+    @property
+    def content_db(self):
+        """Contenido de la instantánea actual (solo lectura)"""
+        return self.catalog.content
+    
+    def scan_content(self):
+        """Escanea las carpetas de contenido y publica una nueva instantánea"""
+        with self.scan_lock:
+            with self.tracer.profile('scan_content'):
+                self._scan_content()
+        self.scan_ready.set()
+    
+    def _scan_content(self):
+        print("🔍 Escaneando contenido...")
+        scan_started = time.monotonic()
+        
+        # Recorrer cada raíz en el pool de su volumen: un disco lento no
+        # bloquea el escaneo de los demás
+        walks = []
+        for root in self.library_roots:
+            print(f"📁 Buscando en: {root['path']}")
+            volume = self.root_volumes[root['path']]
+            walks.append((root, volume, volume.executor.submit(self.walk_videos, root['path'])))
+        
+        # Procesar cada video (miniatura y duración) también en su volumen
+        pending = []
+        for root, volume, walk in walks:
+            files = walk.result()
+            print(f"📄 {len(files)} videos en {root['path']}")
+            for video_path in files:
+                pending.append(volume.executor.submit(self.scan_video, root['path'], volume, video_path))
+        
+        movies = self.deduplicate([future.result() for future in pending])
+        self.save_id_cache(movies)
+        
+        sprites, sprite_rows = self.build_sprite_rows({'movies': movies})
+        
+        # Publicar: los lectores pasan a la nueva versión en su siguiente petición
+        self.catalog = Catalog(self.catalog.version + 1, movies, sprite_rows, sprites)
+        self.popularity.retag({movie.id: ('trending', movie.genre) if movie.genre else ('trending',)
+                               for movie in movies})
+        self.home_rows()
+        self.metrics.set('streamflix_catalog_version', self.catalog.version)
+        self.metrics.set('streamflix_scan_duration_seconds', round(time.monotonic() - scan_started, 3))
+        self.metrics.set('streamflix_library_titles', len(movies))
+        print(f"✅ Encontradas {len(movies)} películas")
+    
+    def get_video_id(self, video_path):
+        """Id estable a partir del contenido: sobrevive a renombrados y movimientos"""
+        stat = os.stat(video_path)
+        cached = self.id_cache.get(video_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        
+        video_id = fingerprint_file(video_path, stat.st_size)
+        with self.id_cache_lock:
+            self.id_cache[video_path] = [stat.st_size, stat.st_mtime, video_id]
+        return video_id
+    
+    def save_id_cache(self, movies):
+        """Guarda las huellas de los archivos presentes (olvida los desaparecidos)"""
+        present = set()
+        for movie in movies:
+            present.add(movie.path)
+            present.update(movie.duplicates or ())
+        with self.id_cache_lock:
+            self.id_cache = {path: entry for path, entry in self.id_cache.items() if path in present}
+            data = json.dumps(self.id_cache)
+        try:
+            tmp_path = self.ids_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.ids_path)
+        except OSError as e:
+            print(f"⚠️ No se pudieron guardar los ids: {e}")
+    
+    def deduplicate(self, movies):
+        """Une copias idénticas en un solo título y separa colisiones de huella"""
+        # Preferir la copia del volumen más rápido
+        tier_rank = {'ssd': 0, 'nas': 1, 'hdd': 2}
+        by_id = {}
+        for movie in movies:
+            by_id.setdefault(movie.id, []).append(movie)
+        
+        unique = []
+        for video_id, group in by_id.items():
+            group.sort(key=lambda m: (tier_rank.get(self.volumes[m.volume].tier, 3), m.path))
+            kept = []
+            for movie in group:
+                for original in kept:
+                    if self.same_content(original.path, movie.path):
+                        print(f"♻️ Duplicado: {movie.path} = {original.path}")
+                        original.duplicates = (original.duplicates or ()) + (movie.path,)
+                        break
+                else:
+                    if kept:
+                        # Misma huella pero distinto contenido: id derivado de la ruta
+                        new_id = hashlib.blake2b((video_id + movie.path).encode(), digest_size=8).hexdigest()
+                        print(f"⚠️ Colisión de id {video_id}: {movie.path} pasa a {new_id}")
+                        movie.id = new_id
+                        with self.id_cache_lock:
+                            self.id_cache[movie.path][2] = new_id
+                        thumb_path = os.path.join(self.thumbnails_folder, f"{new_id}.jpg")
+                        if not os.path.exists(thumb_path):
+                            self.generate_thumbnail(movie.path, thumb_path)
+                    kept.append(movie)
+            unique.extend(kept)
+        return unique
+    
+    def same_content(self, path_a, path_b):
+        """Comprobación más densa que la huella del id para confirmar duplicados"""
+        try:
+            size = os.path.getsize(path_a)
+            if size != os.path.getsize(path_b):
+                return False
+            return fingerprint_file(path_a, size, samples=17) == fingerprint_file(path_b, size, samples=17)
+        except OSError:
+            return False
+    
+    def build_sprite_rows(self, rows):
+        """Versiona las filas del carrusel; la versión cambia con sus ids o miniaturas"""
+        sprite_rows = {}
+        index = {}
+        for row, items in rows.items():
+            if not items:
+                continue
+            digest = hashlib.blake2b(digest_size=6)
+            for movie in items:
+                thumb_path = os.path.join(self.thumbnails_folder, f"{movie.id}.jpg")
+                try:
+                    mtime = os.path.getmtime(thumb_path)
+                except OSError:
+                    mtime = 0
+                digest.update(f"{movie.id}:{mtime};".encode())
+            version = digest.hexdigest()
+            sprite_rows[row] = {'version': version, 'ids': [movie.id for movie in items]}
+            index[row] = {'row': row, 'version': version, 'count': len(items), 'per_page': SPRITE_TILES}
+        return index, sprite_rows
+    
+    def home_rows(self):
+        """Filas de la portada vigentes; tras nuevos eventos se regeneran como mucho cada ROWS_MAX_AGE s"""
+        rows = self.rows
+        key = (self.catalog.version, self.popularity.version)
+        if rows.key == key or (rows.key[0] == key[0] and time.monotonic() - rows.built < ROWS_MAX_AGE):
+            return rows
+        with self.rows_lock:
+            if self.rows is rows:
+                self.rows = self.build_home_rows(key)
+            return self.rows
+    
+    def build_home_rows(self, key):
+        """Tendencias y géneros por popularidad; novedades por fecha del archivo"""
+        catalog = self.catalog
+        categories = {
+            'trending': [catalog.by_id[video_id] for video_id in self.popularity.top('trending')
+                         if video_id in catalog.by_id],
+            'new_releases': list(catalog.newest)
+        }
+        for genre in GENRES:
+            # Los más vistos del género y, detrás, el resto por fecha
+            played = [catalog.by_id[video_id] for video_id in self.popularity.top(genre) if video_id in catalog.by_id]
+            seen = {movie.id for movie in played}
+            rest = (movie for movie in catalog.genres.get(genre, ()) if movie.id not in seen)
+            categories[genre] = (played + list(itertools.islice(rest, ROW_LIMIT)))[:ROW_LIMIT]
+        
+        sprites, sprite_rows = self.build_sprite_rows(categories)
+        return HomeRows(key, categories, sprite_rows, sprites)
+    
+    def find_sprite(self, row):
+        """Sprite de una fila: las de la portada o la del catálogo completo"""
+        return self.home_rows().sprite_rows.get(row) or self.catalog.sprite_rows.get(row)
+    
+    def watched(self, movie, file_size):
+        """Callback de fin de stream: suma a la popularidad la fracción del archivo servida"""
+        def record(sent):
+            if sent and file_size:
+                self.popularity.record(movie.id, PopularityTracker.WATCHED * min(1.0, sent / file_size))
+        return record
+    
+    def get_sprite(self, row, page, fmt='jpg'):
+        """Imagen con las miniaturas de una página de la fila, apiladas en vertical"""
+        sprite = self.find_sprite(row)
+        if sprite is None:
+            return None
+        ids = sprite['ids'][page * SPRITE_TILES:(page + 1) * SPRITE_TILES]
+        if not ids:
+            return None
+        
+        key = (row, page, fmt)
+        cached = self.sprite_cache.get(key, sprite['version'])
+        if cached is not None:
+            return cached
+        
+        cv2 = load_cv2()
+        import numpy as np
+        
+        width, height = SPRITE_TILE_SIZE
+        tiles = []
+        for video_id in ids:
+            tile = cv2.imread(os.path.join(self.thumbnails_folder, f"{video_id}.jpg"))
+            if tile is None:
+                tile = np.full((height, width, 3), 34, dtype=np.uint8)
+            elif tile.shape[:2] != (height, width):
+                tile = cv2.resize(tile, (width, height), interpolation=cv2.INTER_AREA)
+            tiles.append(tile)
+        data = encode_image(cv2.vconcat(tiles), fmt, quality=80 if fmt == 'jpg' else None)
+        if data is None:
+            return None
+        
+        self.sprite_cache.put(key, sprite['version'], data)
+        return data
+    
+    def walk_videos(self, root_path):
+        """Busca videos recursivamente con os.scandir (sin seguir enlaces a carpetas)"""
+        video_extensions = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+        found = []
+        stack = [root_path]
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(video_extensions) and entry.is_file():
+                            found.append(entry.path)
+            except OSError as e:
+                print(f"⚠️ No se puede leer {folder}: {e}")
+        return sorted(found)
+    
+    def scan_video(self, root_path, volume, video_path):
+        """Genera la ficha de un video (se ejecuta en el pool de su volumen)"""
+        file_started = time.monotonic()
+        file = os.path.relpath(video_path, root_path).replace(os.sep, '/')
+        video_id = self.get_video_id(video_path)
+        
+        print(f"✅ Video encontrado: {file}")
+        
+        # Generar thumbnail si no existe (reaprovechando la de un id antiguo)
+        thumb_path = os.path.join(self.thumbnails_folder, f"{video_id}.jpg")
+        legacy_path = os.path.join(self.thumbnails_folder, f"{hashlib.md5(file.encode()).hexdigest()[:8]}.jpg")
+        if not os.path.exists(thumb_path) and os.path.exists(legacy_path):
+            os.replace(legacy_path, thumb_path)
+        if not os.path.exists(thumb_path):
+            print(f"🎨 Generando thumbnail para: {file}")
+            self.generate_thumbnail(video_path, thumb_path)
+        elif not os.path.exists(os.path.splitext(thumb_path)[0] + '.webp'):
+            # Miniaturas anteriores a las variantes: completarlas desde el JPEG
+            self.thumbnail_executor.submit(self.write_thumbnail_variants, thumb_path)
+        
+        # Año de estreno del nombre ("Película (2019).mp4", "Pelicula_2019.mp4"); sin él, None.
+        # La fecha del archivo solo sirve para "Novedades" (`added`), no es el año de estreno
+        name = os.path.splitext(os.path.basename(file))[0].replace('_', ' ')
+        added = os.path.getmtime(video_path)
+        year = re.search(r'\b(19\d{2}|20\d{2})\b', name)
+        
+        # Género de la carpeta que lo contiene (Movies/Terror/...)
+        folders = [folder.lower().replace('_', ' ') for folder in file.split('/')[:-1]]
+        genre = next((GENRE_FOLDERS[folder] for folder in reversed(folders) if folder in GENRE_FOLDERS), None)
+        
+        movie = Movie(
+            id=video_id,
+            title=name.title(),
+            file=file,
+            root=root_path,
+            volume=volume.name,
+            duration=self.get_video_duration(video_path),
+            year=int(year.group(1)) if year else None,
+            genre=genre,
+            added=added
+        )
+        
+        self.metrics.observe('streamflix_scan_file_seconds', time.monotonic() - file_started, volume=volume.name)
+        return movie
+    
+    def build_assets(self):
+        """Compila la página principal y sus recursos CSS/JS con huella"""
+        css = StaticAsset('app.css', INDEX_CSS, 'text/css; charset=utf-8')
+        js = StaticAsset('app.js', INDEX_JS, 'application/javascript; charset=utf-8')
+        html = INDEX_HTML.replace('__APP_CSS__', f'/assets/{css.name}').replace('__APP_JS__', f'/assets/{js.name}')
+        
+        self.index_page = StaticAsset('index.html', html, 'text/html; charset=utf-8')
+        self.assets = {css.name: css, js.name: js}
+    
+    def send_asset(self, asset, immutable):
+        """Responde con la variante comprimida que acepte el cliente"""
+        from flask import request, Response
+        
+        if request.if_none_match.contains(asset.etag):
+            response = Response(status=304)
+        else:
+            body, encoding = asset.body, None
+            for candidate in ('br', 'gzip'):
+                if candidate in asset.encodings and request.accept_encodings[candidate]:
+                    body, encoding = asset.encodings[candidate], candidate
+                    break
+            response = Response(body, mimetype=asset.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        
+        response.set_etag(asset.etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Los recursos con huella no cambian nunca; la página se revalida (304)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+        return response
+    
+    def setup_routes(self):
+        from flask import send_file, jsonify, request, Response
         
-        function likeVideo(videoId) {
-            console.log('Like:', videoId);
-        }
+        @self.app.route('/')
+        def index():
+            return self.send_asset(self.index_page, immutable=False)
         
-        // Cargar al inicio
-        loadContent();
-    </script>
-</body>
-</html>
-            ''')
+        @self.app.route('/assets/<name>')
+        def get_asset(name):
+            asset = self.assets.get(name)
+            if asset is None:
+                return '', 404
+            return self.send_asset(asset, immutable=True)
         
         @self.app.route('/api/content')
         def get_content():
-            return jsonify(self.content_db)
+            # JSON precalculado de la instantánea, con ETag para revalidar (304)
+            return self.send_asset(self.catalog.asset, immutable=False)
+        
+        @self.app.route('/api/categories')
+        def get_categories():
+            # Filas de la portada, pequeñas y con ETag propio: cambian con cada reproducción
+            return self.send_asset(self.home_rows().asset, immutable=False)
+        
+        @self.app.route('/api/rescan', methods=['POST'])
+        def rescan():
+            # El catálogo actual se sigue sirviendo hasta que termine el nuevo escaneo
+            if self.scan_lock.locked():
+                return jsonify({'status': 'scanning', 'version': self.catalog.version}), 409
+            threading.Thread(target=self.scan_content, daemon=True).start()
+            return jsonify({'status': 'started', 'version': self.catalog.version}), 202
         
         @self.app.route('/api/play/<video_id>')
         def get_video_url(video_id):
@@ -882,26 +2899,66 @@ class StreamFlix:
             is_tv = any(tv in user_agent for tv in ['tv', 'smart', 'tizen', 'webos', 'roku', 'hbbtv'])
             
             # Buscar video por ID
-            for movie in self.content_db['movies']:
-                if movie['id'] == video_id:
-                    # Usar streaming normal para mejor rendimiento
-                    stream_url = f'/stream/{video_id}'
-                    return jsonify({
-                        'url': stream_url,
-                        'title': movie['title'],
-                        'is_tv': is_tv
-                    })
+            movie = self.catalog.get(video_id)
+            
+            # En modo peer, el nodo menos cargado que tenga el título
+            node = None
+            if self.peers is not None:
+                peer = self.peers.pick(video_id, self.node_status(), movie is not None)
+                if peer is not None:
+                    node = peer['url']
+                    self.metrics.inc('streamflix_play_redirects_total')
+            
+            if movie is None and node is None:
+                return jsonify({'error': 'Video not found'}), 404
+            if movie is not None:
+                self.hot_cache.record_play(movie, self.volumes.get(movie.volume))
+                self.popularity.record(movie.id, PopularityTracker.PLAY)
             
-            return jsonify({'error': 'Video not found'}), 404
+            # Usar streaming normal para mejor rendimiento
+            # La sesión identifica a este reproductor: sus seeks sustituyen a su stream anterior
+            stream_url = f'{node or ""}/stream/{video_id}'
+            session = os.urandom(8).hex()
+            return jsonify({
+                'url': f'{stream_url}?session={session}',
+                'compat_url': f'{stream_url}/compat?session={session}',
+                'title': movie.title if movie is not None else None,
+                'is_tv': is_tv,
+                'node': node or (self.peers.url if self.peers is not None else None)
+            })
+        
+        @self.app.route('/api/peer/titles')
+        def get_peer_titles():
+            # Para peers con otro catálogo: qué títulos puede servir este nodo
+            catalog = self.catalog
+            return jsonify({'catalog': catalog.digest, 'ids': list(catalog.by_id)})
+        
+        @self.app.route('/metrics')
+        def get_metrics():
+            return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
         
         @self.app.route('/stream/<video_id>')
         def stream_video(video_id):
+            started = time.monotonic()
+            trace = self.tracer.request('stream', video_id)
+            lookup_started = time.perf_counter()
+            
             # Buscar video
             video_path = None
-            for movie in self.content_db['movies']:
-                if movie['id'] == video_id:
-                    video_path = movie['path']
-                    break
+            volume = None
+            movie = self.catalog.get(video_id)
+            if movie is not None:
+                video_path = movie.path
+                volume = self.volumes.get(movie.volume)
+                
+                # Servir desde la caché rápida si hay una copia válida
+                cached_path = self.hot_cache.lookup(movie)
+                if cached_path:
+                    video_path = cached_path
+                    volume = self.cache_volume
+            
+            if trace is not None:
+                trace.mark('id_lookup', lookup_started, found=video_path is not None)
             
             if not video_path or not os.path.exists(video_path):
                 return "Video not found", 404
@@ -910,11 +2967,26 @@ class StreamFlix:
             user_agent = request.headers.get('User-Agent', '').lower()
             is_tv = any(tv in user_agent for tv in ['tv', 'smart', 'tizen', 'webos', 'roku', 'hbbtv'])
             
+            throttle = self.open_throttle(is_tv)
+            stream = self.open_stream(video_id, 'stream')
+            
             # Si no hay rango especificado y es TV, devolver todo el archivo
             range_header = request.headers.get('range', None)
             if not range_header and is_tv:
                 # Devolver archivo completo para TVs que no soporten streaming parcial
-                return send_file(video_path, mimetype='video/mp4')
+                # (leído por el pool del volumen, no con send_file)
+                file_size = os.path.getsize(video_path)
+                response = Response(
+                    self.instrument_stream(self.iter_file(video_path, 0, file_size, throttle, trace, volume, stream), 'stream', started,
+                                         self.watched(movie, file_size)),
+                    mimetype='video/mp4',
+                    headers={
+                        'Accept-Ranges': 'bytes',
+                        'Content-Length': str(file_size)
+                    }
+                )
+                response.call_on_close(lambda: self.streams.close(stream))
+                return response
             
             # Streaming con soporte para seek
             byte_start = 0
@@ -936,22 +3008,13 @@ class StreamFlix:
                 byte_end = min(byte_start + chunk_size, file_size - 1)
             
             content_length = byte_end - byte_start + 1
-            
-            def generate():
-                with open(video_path, 'rb') as f:
-                    f.seek(byte_start)
-                    remaining = content_length
-                    while remaining:
-                        to_read = min(65536, remaining)
-                        data = f.read(to_read)
-                        if not data:
-                            break
-                        remaining -= len(data)
-                        yield data
+            if range_header:
+                self.metrics.observe('streamflix_range_request_bytes', content_length, route='stream')
             
             # Headers optimizados para TVs
             response = Response(
-                generate(),
+                self.instrument_stream(self.iter_file(video_path, byte_start, content_length, throttle, trace, volume, stream), 'stream', started,
+                                     self.watched(movie, file_size)),
                 status=206,
                 mimetype='video/mp4',  # Forzar MP4 para mayor compatibilidad
                 headers={
@@ -967,83 +3030,203 @@ class StreamFlix:
                     'Access-Control-Expose-Headers': 'Content-Length, Content-Range'
                 }
             )
+            response.call_on_close(lambda: self.streams.close(stream))
             
             return response
         
         @self.app.route('/stream/<video_id>/compat')
         def stream_compatible_video(video_id):
             """Streaming con conversión en tiempo real para TVs"""
+            started = time.monotonic()
+            trace = self.tracer.request('compat', video_id)
+            lookup_started = time.perf_counter()
+            
             # Buscar video
             video_path = None
-            for movie in self.content_db['movies']:
-                if movie['id'] == video_id:
-                    video_path = movie['path']
-                    break
+            movie = self.catalog.get(video_id)
+            if movie is not None:
+                video_path = self.hot_cache.lookup(movie) or movie.path
+            
+            if trace is not None:
+                trace.mark('id_lookup', lookup_started, found=video_path is not None)
             
             if not video_path or not os.path.exists(video_path):
                 return "Video not found", 404
             
+            user_agent = request.headers.get('User-Agent', '').lower()
+            is_tv = any(tv in user_agent for tv in ['tv', 'smart', 'tizen', 'webos', 'roku', 'hbbtv'])
+            # Posición de inicio en segundos (?t=) para los saltos del reproductor
+            start = request.args.get('t', 0.0, type=float)
+            if not 0 < start < float('inf'):
+                start = 0.0
+            if trace is not None and start:
+                trace.instant('seek', t=start)
+            
+            throttle = self.open_throttle(is_tv)
+            stream = self.open_stream(video_id, 'compat')
+            
             # Usar ffmpeg para transcodificar en tiempo real (opcional)
             # Esto requiere tener ffmpeg instalado
             try:
-                command = [
-                    'ffmpeg',
+                command = ['ffmpeg']
+                if start:
+                    # -ss antes de -i: salta al keyframe previo sin decodificar desde el principio
+                    command += ['-ss', f'{start:.3f}']
+                command += [
                     '-i', video_path,
                     '-c:v', 'libx264',      # Codec H.264 (más compatible)
                     '-preset', 'ultrafast',  # Conversión rápida
                     '-crf', '23',           # Calidad
+                    '-g', '48',             # GOP corto: el primer fragmento sale en ~2s de vídeo
                     '-c:a', 'aac',          # Audio AAC
                     '-b:a', '128k',
+                ]
+                if start:
+                    # Timestamps desde `start` para que el reproductor muestre la posición real
+                    command += ['-output_ts_offset', f'{start:.3f}']
+                command += [
                     '-movflags', 'frag_keyframe+empty_moov+faststart',
                     '-f', 'mp4',            # Formato MP4
                     'pipe:1'                # Salida a stdout
                 ]
                 
                 def generate():
+                    # Esperar un hueco libre para ffmpeg (o abandonar si el cliente se va)
+                    queue_started = time.perf_counter()
+                    self.metrics.inc('streamflix_ffmpeg_queued')
+                    acquired = False
                     try:
+                        while not acquired and stream.alive():
+                            acquired = self.transcode_slots.acquire(timeout=ActiveStream.LIVENESS_INTERVAL)
+                    finally:
+                        self.metrics.dec('streamflix_ffmpeg_queued')
+                    if not acquired:
+                        return
+                    self.metrics.inc('streamflix_ffmpeg_active')
+                    if trace is not None:
+                        trace.mark('ffmpeg_queue', queue_started)
+                    
+                    disconnected = False
+                    watching = False
+                    try:
+                        spawn_started = time.perf_counter()
                         process = subprocess.Popen(
                             command,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.DEVNULL,
                             bufsize=65536
                         )
+                        if trace is not None:
+                            trace.mark('ffmpeg_spawn', spawn_started, pid=process.pid)
+                        
+                        # Vigilar al cliente mientras ffmpeg trabaja: matarlo desbloquea la lectura
+                        stream.attach(process)
+                        threading.Thread(target=self.watch_transcode, args=(stream, process), daemon=True).start()
+                        watching = True
                         
                         while True:
+                            if trace is not None:
+                                chunk_started = time.perf_counter()
                             chunk = process.stdout.read(65536)
                             if not chunk:
+                                disconnected = stream.cancelled.is_set()
                                 break
+                            if throttle is not None:
+                                throttle.consume(len(chunk), stream.cancelled)
+                            if trace is not None:
+                                trace.chunk(chunk_started, len(chunk))
                             yield chunk
+                    except GeneratorExit:
+                        disconnected = True
+                        raise
                     finally:
                         try:
                             process.terminate()
-                            process.wait()
+                            process.wait(timeout=5)
+                        except subprocess.TimeoutExpired:
+                            process.kill()
                         except:
                             pass
+                        if watching:
+                            stream.cancelled.set()
+                        else:
+                            # ffmpeg no llegó a arrancar: no hay vigilante que libere el hueco
+                            self.metrics.dec('streamflix_ffmpeg_active')
+                            self.transcode_slots.release()
+                        if trace is not None:
+                            trace.finish(disconnected)
                 
-                return Response(
-                    generate(),
+                # Sin callback de popularidad: los bytes transcodificados no miden la parte
+                # vista del archivo y cada salto relanza ffmpeg; la visita ya la cuenta /api/play
+                response = Response(
+                    self.instrument_stream(generate(), 'compat', started),
                     mimetype='video/mp4',
                     headers={
                         'Cache-Control': 'no-cache',
-                        'Access-Control-Allow-Origin': '*'
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Expose-Headers': 'X-Stream-Offset',
+                        'X-Stream-Offset': f'{start:.3f}'
                     }
                 )
+                response.call_on_close(lambda: self.streams.close(stream))
+                return response
             except:
                 # Si ffmpeg no está disponible, usar streaming normal
+                self.streams.close(stream)
                 return send_file(video_path, mimetype='video/mp4')
         
+        @self.app.route('/api/debug/streams')
+        def get_active_streams():
+            return jsonify(self.streams.snapshot())
+        
+        @self.app.route('/api/debug/peers')
+        def get_peers():
+            if self.peers is None:
+                return jsonify({'error': 'Peer mode disabled'}), 404
+            return jsonify(dict(self.peers.snapshot(), load=PeerDirectory.load_score(self.node_status())))
+        
+        @self.app.route('/api/debug/trace')
+        def get_trace():
+            """Trazas en formato Chrome trace (abrir con chrome://tracing o Perfetto)"""
+            if not self.tracer.enabled:
+                return jsonify({'error': 'Tracing disabled'}), 404
+            trace = self.tracer.export()
+            if request.args.get('clear'):
+                self.tracer.clear()
+            return jsonify(trace)
+        
+        @self.app.route('/thumbnail/sprite/<row>/<int:page>.jpg')
+        def get_thumbnail_sprite(row, page):
+            data = None
+            for fmt in self.accepted_image_formats():
+                data = self.get_sprite(row, page, fmt)
+                if data is not None:
+                    break
+            if data is None:
+                return '', 404
+            # La URL lleva la versión de la fila: se puede cachear para siempre
+            sprite = self.find_sprite(row)
+            versioned = sprite is not None and request.args.get('v') == sprite['version']
+            return Response(data, mimetype=IMAGE_FORMATS[fmt], headers={
+                'Cache-Control': 'public, max-age=31536000, immutable' if versioned else 'no-cache',
+                'Vary': 'Accept'
+            })
+        
         @self.app.route('/thumbnail/<video_id>.jpg')
         def get_thumbnail(video_id):
-            thumb_path = os.path.join(self.thumbnails_folder, f"{video_id}.jpg")
-            if os.path.exists(thumb_path):
-                return send_file(thumb_path, mimetype='image/jpeg')
-            else:
-                # Generar placeholder
-                return '', 404
+            # La variante más compacta que acepte el cliente; JPEG como respaldo
+            for fmt in self.accepted_image_formats():
+                thumb_path = os.path.join(self.thumbnails_folder, f"{video_id}.{fmt}")
+                if os.path.exists(thumb_path):
+                    response = send_file(thumb_path, mimetype=IMAGE_FORMATS[fmt])
+                    response.headers['Vary'] = 'Accept'
+                    return response
+            
+            # Generar placeholder
+            return '', 404
     
     def run(self):
         import webbrowser
-        import re
         
         url = f"http://{self.host}:{self.port}"
         
@@ -1053,33 +3236,84 @@ class StreamFlix:
         print(f"\n📱 Accede desde cualquier dispositivo:")
         print(f"   {url}")
         print(f"\n📁 Carpetas de contenido:")
-        print(f"   • Películas → {self.movies_folder}")
+        for root in self.library_roots:
+            volume = self.root_volumes[root['path']]
+            print(f"   • Películas → {root['path']} ({volume.tier}, {volume.concurrency} E/S)")
         print(f"   • Series → {self.series_folder}")
+        if self.peers is not None:
+            print(f"\n🖧 Modo peer: anunciado como {self.peers.url} (UDP {self.peers.port})")
         print(f"\n💡 Coloca tus videos MP4/MKV/AVI en las carpetas")
         print("\n🔄 Ctrl+C para detener")
         print("="*60 + "\n")
         
-        # Abrir carpetas
-        for folder in [self.movies_folder, self.series_folder]:
-            try:
-                os.startfile(folder)  # Windows
-            except:
+        if not self.headless:
+            # Abrir carpetas
+            for folder in [self.movies_folder, self.series_folder]:
                 try:
-                    os.system(f'open "{folder}"')  # macOS
+                    os.startfile(folder)  # Windows
                 except:
-                    os.system(f'xdg-open "{folder}"')  # Linux
-        
-        # Abrir navegador
-        threading.Timer(1.5, lambda: webbrowser.open(url)).start()
+                    try:
+                        os.system(f'open "{folder}"')  # macOS
+                    except:
+                        os.system(f'xdg-open "{folder}"')  # Linux
+            
+            # Abrir navegador
+            threading.Timer(1.5, lambda: webbrowser.open(url)).start()
         
         # Ejecutar servidor
         self.app.run(host='0.0.0.0', port=self.port, debug=False, threaded=True)
 
 if __name__ == "__main__":
-    import re  # Importar re para el streaming
+    import argparse
     
-    netflix = StreamFlix()
+    parser = argparse.ArgumentParser(description='StreamFlix - Tu Netflix Personal')
+    parser.add_argument('--trace', nargs='?', const='streamflix-trace.json', metavar='FILE',
+                        help='Activar el tracing; al salir se guarda en FILE (Chrome trace)')
+    parser.add_argument('--headless', action='store_true',
+                        help='Modo servidor: sin abrir ventanas y escaneando en segundo plano')
+    parser.add_argument('--library', action='append', metavar='RUTA[:TIPO[:N]]',
+                        help='Raíz de la biblioteca (repetible); TIPO = ssd, hdd o nas; N = E/S simultáneas')
+    parser.add_argument('--cache-dir', metavar='RUTA',
+                        help='Carpeta de la caché rápida (SSD) para títulos de volúmenes lentos')
+    parser.add_argument('--cache-size', type=float, default=20, metavar='GB',
+                        help='Tamaño máximo de la caché rápida en GB (por defecto 20)')
+    parser.add_argument('--port', type=int, default=8888, help='Puerto HTTP (por defecto 8888)')
+    parser.add_argument('--rate-global', type=float, metavar='MBIT',
+                        help='Límite total de subida en Mbit/s (por defecto sin límite)')
+    parser.add_argument('--rate-client', type=float, metavar='MBIT',
+                        help='Límite por IP de cliente en Mbit/s (por defecto sin límite)')
+    parser.add_argument('--rate-connection', type=float, metavar='MBIT',
+                        help='Límite por conexión en Mbit/s (por defecto sin límite)')
+    parser.add_argument('--peers', action='store_true',
+                        help='Modo peer: descubrir otros nodos en la LAN y repartir los streams')
+    parser.add_argument('--advertise', metavar='URL',
+                        help='URL con la que los demás nodos alcanzan a este (por defecto http://IP:PUERTO)')
+    parser.add_argument('--discovery-port', type=int, default=8899,
+                        help='Puerto UDP de descubrimiento (por defecto 8899)')
+    parser.add_argument('--announce-to', action='append', metavar='DIRECCION',
+                        help='Destino de los anuncios (repetible): grupo multicast (por defecto '
+                             f'{PeerDirectory.GROUP}), broadcast o un nodo de otra máquina. Los nodos '
+                             'de una misma máquina necesitan multicast o broadcast')
+    args = parser.parse_args()
+    
+    library_roots = [parse_library_root(spec) for spec in args.library] if args.library else None
+    # Mbit/s -> bytes/s
+    mbit = lambda rate: rate * 125000 if rate else None
+    try:
+        PeerDirectory.check_targets(args.announce_to or ())
+    except ValueError as e:
+        parser.error(str(e))
+    netflix = StreamFlix(trace=bool(args.trace), headless=args.headless, library_roots=library_roots,
+                         cache_folder=args.cache_dir, cache_max_bytes=int(args.cache_size * 1024 ** 3),
+                         port=args.port, peer_mode=args.peers, advertise_url=args.advertise,
+                         discovery_port=args.discovery_port, announce_to=args.announce_to,
+                         global_rate=mbit(args.rate_global), client_rate=mbit(args.rate_client),
+                         connection_rate=mbit(args.rate_connection))
     try:
         netflix.run()
     except KeyboardInterrupt:
         print("\n\n🎬 ¡Hasta la próxima!")
+    finally:
+        if args.trace:
+            netflix.tracer.dump(args.trace)
+            print(f"🧭 Trazas guardadas en {args.trace}")